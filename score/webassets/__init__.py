@@ -37,12 +37,19 @@ Currently it provides two features to be used by others - virtual assets and
 asset versioning - as well as an adaption for the pyramid framework.
 """
 
-from ._init import init, ConfiguredWebassetsModule, AssetNotFound, Request
-from .proxy import TemplateWebassetsProxy, WebassetsProxy
+from ._init import (
+    init, ConfiguredWebassetsModule, AssetCollector, AssetNotFound, Request,
+    WarmupStatus)
+from .planner import BundlePlanner
+from .proxy import (
+    TemplateWebassetsProxy, WebassetsProxy, CachingWebassetsProxy,
+    FileWebassetsProxy)
 
 
 __version__ = '0.3.26'
 
 __all__ = (
-    'init', 'ConfiguredWebassetsModule', 'AssetNotFound', 'Request',
-    'TemplateWebassetsProxy', 'WebassetsProxy',)
+    'init', 'ConfiguredWebassetsModule', 'AssetCollector', 'AssetNotFound',
+    'Request', 'WarmupStatus', 'BundlePlanner',
+    'TemplateWebassetsProxy', 'WebassetsProxy', 'CachingWebassetsProxy',
+    'FileWebassetsProxy',)
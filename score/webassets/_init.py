@@ -25,15 +25,30 @@
 # the discretion of STRG.AT GmbH also the competent court, in whose district
 # the Licensee has his registered seat, an establishment or assets.
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import contextlib
+import contextvars
 import email.utils
+import functools
+import gc
+import gzip
+import json
+import mimetypes
 import os
 import re
+import threading
 import time
+import zlib
+from urllib.parse import parse_qsl
 
 from score.init import (
-    ConfiguredModule, ConfigurationError, parse_list, parse_bool)
-import xxhash
+    ConfiguredModule, ConfigurationError, parse_list, parse_bool,
+    parse_dotted_path)
+
+from .dependencies import DependencyGraph
+from .hashing import algorithms as hash_algorithms, new_hash, feed
+from .planner import BundlePlanner
+from .trace import Span, TraceCollector
 
 Request = namedtuple('Request', ('path', 'GET', 'headers'))
 
@@ -41,9 +56,79 @@ defaults = {
     'rootdir': None,
     'modules': [],
     'freeze': False,
+    'url_style': 'query',
+    'hash_algorithm': 'xxh64',
     'tpl.autobundle': False,
+    'tpl.chunk_size': 0,
+    'tpl.shared_bundles': 0,
+    'tpl.bundle_plan': None,
+    'tpl.inline_threshold': 0,
+    'tpl.inline_exclude': [],
+    'warmup': False,
+    'manifest': None,
+    'body_cache': None,
+    'body_cache.size': 64 * 1024 * 1024,
 }
 
+url_styles = ('query', 'path')
+
+_path_hash_regex = re.compile(r'^_v([0-9a-f]+)/(.+)$')
+
+_hash_regex = re.compile(r'^[0-9a-f]+$')
+
+_immutable_cache_control = 'public, max-age=31536000, immutable'
+
+# maximum number of entries in the caches of immutable responses
+_response_cache_limit = 4096
+
+_no_trace = contextlib.nullcontext()
+
+
+def _traced(operation):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, module, *paths, **kwargs):
+            with self._trace(operation, module, paths):
+                return func(self, module, *paths, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _is_text(mimetype):
+    """
+    Whether assets with given *mimetype* are provided as strings.
+    """
+    mimetype = mimetype.split(';', maxsplit=1)[0].strip()
+    return (
+        mimetype.startswith('text/') or
+        mimetype.endswith(('+xml', '+json')) or
+        mimetype in ('application/javascript', 'application/json',
+                     'application/xml'))
+
+
+def _encode(content):
+    """
+    Converts rendered *content* to a bytes-like object. Strings are encoded
+    as UTF-8, whereas `bytes` and `memoryview` objects are passed through
+    without copying.
+    """
+    if isinstance(content, str):
+        return content.encode('UTF-8')
+    if isinstance(content, (bytes, memoryview)):
+        return content
+    return bytes(content)
+
+
+def _content_type(mimetype):
+    """
+    Returns the value of the Content-Type header for given *mimetype*,
+    declaring the UTF-8 charset for textual assets, unless the *mimetype*
+    already contains a charset.
+    """
+    if _is_text(mimetype) and 'charset=' not in mimetype:
+        return '%s; charset=utf-8' % (mimetype,)
+    return mimetype
+
 
 def init(confdict, http=None, tpl=None):
     """
@@ -64,12 +149,103 @@ def init(confdict, http=None, tpl=None):
 
         See :ref:`webassets_freezing` for valid values.
 
+    :confkey:`transforms.<module>` :confdefault:`[]`
+        A list of dotted paths to :mod:`bundle transforms
+        <score.webassets.transforms>`, that should be applied to all bundles
+        of given module, when they are written to the *rootdir*. Example:
+
+        .. code-block:: ini
+
+            transforms.css =
+                score.webassets.transforms.strip_css_comments
+                score.webassets.transforms.strip_css_whitespace
+
+        The transforms are part of the :term:`bundle hash <asset hash>`.
+        Their effect is recorded in
+        :attr:`ConfiguredWebassetsModule.transform_stats`.
+
+    :confkey:`hash_algorithm` :confdefault:`xxh64`
+        The :mod:`hash algorithm <score.webassets.hashing>` to use for
+        :term:`asset hashes <asset hash>` and bundle names. Valid values are
+        ``xxh64``, ``xxh3_64``, ``xxh3_128`` (the latter two require xxhash
+        2.0) and ``blake2b``, which should be used if collisions are a
+        concern.
+
+    :confkey:`url_style` :confdefault:`query`
+        Where to put the :term:`asset hash` in generated URLs. The default
+        value ``query`` appends it as a query string parameter
+        (``/css/reset.css?_v=0b2931cc6255c72e``), whereas ``path`` inserts it
+        as a separate path segment
+        (``/css/_v0b2931cc6255c72e/reset.css``). The latter should be used if
+        caching proxies or CDNs ignore query strings.
+
+    :confkey:`manifest` :confdefault:`None`
+        Path to a JSON file containing pre-calculated :term:`asset hashes
+        <asset hash>`, as written by the ``score webassets watch`` command or
+        :meth:`ConfiguredWebassetsModule.write_manifest`. Hashes found
+        in this file take precedence over calculated or frozen hashes, unless
+        the *freeze* value is a string. The file is re-read whenever it
+        changes, so a running application picks up the hashes of a
+        concurrently running ``watch`` process.
+
+    :confkey:`body_cache` :confdefault:`None`
+        Path to a file backing a :class:`shared body cache
+        <score.webassets.bodycache.SharedBodyCache>`, which should be located
+        on a memory file system like ``/dev/shm``. All processes configured
+        with the same file share the bodies of all hashed assets (and their
+        gzip-compressed variants, which are sent to clients accepting them),
+        so each body is loaded and compressed only once per host.
+
+    :confkey:`body_cache.size` :confdefault:`67108864`
+        The number of bytes available for bodies in the *body_cache*. Only
+        used when the file is created.
+
+    :confkey:`warmup` :confdefault:`False`
+        Whether all default assets and bundles should be hashed and written to
+        the *rootdir* right after initialization, so the first requests do not
+        have to wait for it. The value ``True`` performs the warm-up in a
+        background thread, whereas ``finalize`` blocks the initialization
+        until it is done. See :meth:`ConfiguredWebassetsModule.warmup`.
+
     :confkey:`tpl.autobundle` :confdefault:`False`
         Whether the webassets_* functions registered with :mod:`score.tpl`
         should provide :term:`bundles <asset bundle>` instead of separate
         files. This should be set to `True` on deployment systems to speed up
         web page rendering.
 
+    :confkey:`tpl.chunk_size` :confdefault:`0`
+        If this value is greater than zero, the default bundle of each module
+        will be split into several bundles, each containing at most this many
+        bytes (unless a single asset is larger). The split points are derived
+        from the asset paths, so a change in a single file only invalidates
+        the bundles containing it (and, if its size changes, possibly those
+        next to it). Browsers can also download the bundles in parallel. Only
+        relevant if :confkey:`tpl.autobundle` is enabled.
+
+    :confkey:`tpl.shared_bundles` :confdefault:`0`
+        Setting this to a number greater than zero enables extraction of
+        shared bundles: assets, that are part of at least this many different
+        ad-hoc bundles (as in ``webassets_link('js', 'a.js', 'b.js')``), are
+        delivered in separate, common bundles. See :class:`BundlePlanner`
+        for details. Only relevant if :confkey:`tpl.autobundle` is enabled.
+
+    :confkey:`tpl.bundle_plan` :confdefault:`None`
+        Path to a JSON file containing the known ad-hoc bundles, as written by
+        :meth:`BundlePlanner.save`. Creating this file at build time with
+        ``score webassets bundle-plan`` keeps the shared bundles stable in
+        production.
+
+    :confkey:`tpl.inline_threshold` :confdefault:`0`
+        Assets (and bundles) smaller than this many bytes are embedded
+        directly into the page by the ``webassets_link`` function, instead of
+        being loaded with a separate HTTP request. The proxy decides how to
+        embed them via :meth:`WebassetsProxy.render_inline`. The value ``0``
+        disables inlining.
+
+    :confkey:`tpl.inline_exclude` :confdefault:`[]`
+        A list of module names, whose assets should never be inlined,
+        regardless of :confkey:`tpl.inline_threshold`.
+
     """
     conf = dict(defaults.items())
     conf.update(confdict)
@@ -81,18 +257,94 @@ def init(confdict, http=None, tpl=None):
         freeze = parse_bool(conf['freeze'])
     except ValueError:
         freeze = conf['freeze']
+    try:
+        warmup = parse_bool(conf['warmup'])
+    except ValueError:
+        warmup = conf['warmup']
+        if warmup != 'finalize':
+            raise ConfigurationError(
+                'score.webassets', 'Invalid warmup value "%s"' % (warmup,))
+    if not hash_algorithms.get(conf['hash_algorithm']):
+        raise ConfigurationError(
+            'score.webassets',
+            'Hash algorithm "%s" not available' % (conf['hash_algorithm'],))
+    if conf['url_style'] not in url_styles:
+        raise ConfigurationError(
+            'score.webassets', 'Invalid url_style "%s"' % (conf['url_style'],))
     return ConfiguredWebassetsModule(
         http, tpl, modules, conf['rootdir'], freeze,
-        parse_bool(conf['tpl.autobundle']))
+        parse_bool(conf['tpl.autobundle']), url_style=conf['url_style'],
+        tpl_chunk_size=int(conf['tpl.chunk_size']),
+        tpl_inline_threshold=int(conf['tpl.inline_threshold']),
+        tpl_inline_exclude=parse_list(conf['tpl.inline_exclude']),
+        bundle_planner=_init_bundle_planner(conf),
+        transforms=_init_transforms(conf), warmup=warmup,
+        hash_algorithm=conf['hash_algorithm'], manifest=conf['manifest'],
+        body_cache=_init_body_cache(conf))
+
+
+def _init_transforms(conf):
+    transforms = {}
+    for key, value in conf.items():
+        if not key.startswith('transforms.'):
+            continue
+        module = key[len('transforms.'):]
+        transforms[module] = []
+        for path in parse_list(value):
+            transform = parse_dotted_path(path)
+            identity = getattr(transform, 'identity', path)
+            transforms[module].append((identity, transform))
+    return transforms
+
+
+def _init_body_cache(conf):
+    if not conf['body_cache']:
+        return None
+    # imported here, since the body cache is not available on all platforms
+    from .bodycache import SharedBodyCache
+    return SharedBodyCache(conf['body_cache'], int(conf['body_cache.size']))
+
+
+def _init_bundle_planner(conf):
+    min_count = int(conf['tpl.shared_bundles'])
+    if not min_count:
+        return None
+    return BundlePlanner(min_count, conf['tpl.bundle_plan'])
 
 
 class ConfiguredWebassetsModule(ConfiguredModule):
     """
     This module's :class:`configuration class
     <score.init.ConfiguredModule>`.
+
+    .. attribute:: body_cache
+
+        The :class:`score.webassets.bodycache.SharedBodyCache` configured via
+        :confkey:`body_cache`, or `None`.
+
+    .. attribute:: dependency_graph
+
+        A :class:`score.webassets.dependencies.DependencyGraph` containing
+        the :meth:`dependencies <WebassetsProxy.dependencies>` of all assets,
+        that were hashed so far.
+
+    .. attribute:: transform_stats
+
+        A `dict` mapping 2-tuples ``(module, transform identity)`` to the
+        accumulated effect of each configured :mod:`bundle transform
+        <score.webassets.transforms>` in this process. The values are dicts
+        containing the number of ``runs``, the total ``seconds`` spent in the
+        transform and the total size of the UTF-8 encoded bundles in bytes
+        before and after the transformation (``bytes_before`` and
+        ``bytes_after``).
     """
 
-    def __init__(self, http, tpl, modules, rootdir, freeze, tpl_autobundle):
+    def __init__(self, http, tpl, modules, rootdir, freeze, tpl_autobundle,
+                 *, url_style='query', tpl_chunk_size=0,
+                 bundle_planner=None, transforms=None, warmup=False,
+                 hash_algorithm='xxh64', manifest=None,
+                 tpl_inline_threshold=0, tpl_inline_exclude=(),
+                 body_cache=None):
         super().__init__(__package__)
         self.http = http
         self.tpl = tpl
@@ -100,7 +352,44 @@ class ConfiguredWebassetsModule(ConfiguredModule):
         self.rootdir = rootdir
         self.freeze = freeze
         self.tpl_autobundle = tpl_autobundle
+        self.url_style = url_style
+        self.hash_algorithm = hash_algorithm
+        self.tpl_chunk_size = tpl_chunk_size
+        self.tpl_inline_threshold = tpl_inline_threshold
+        self.tpl_inline_exclude = set(tpl_inline_exclude)
+        self._inline_tags = {}
+        self.bundle_planner = bundle_planner
+        self.transforms = transforms or {}
+        self.transform_stats = {}
+        self._transform_stats_lock = threading.Lock()
+        self._bundle_contents = {}
         self._frozen_versions = {}
+        self.manifest = manifest
+        self._manifest = None
+        self._manifest_mtime = None
+        self._manifest_checked = 0
+        self.dependency_graph = DependencyGraph()
+        self._warmup = warmup
+        self.warmup_status = None
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._asset_sizes = {}
+        self._bundle_indexes = set()
+        self._known_files = set()
+        self._current_files = {}
+        self._scanned_modules = set()
+        self.body_cache = body_cache
+        self._response_cache = {}
+        self._immutable_headers = {}
+        self._response_cache_lock = threading.Lock()
+        self._collector = contextvars.ContextVar(
+            'score.webassets.collector', default=None)
+        self._trace_hooks = []
+        self._trace_collector = contextvars.ContextVar(
+            'score.webassets.trace_collector', default=None)
+        self._trace_collectors = 0
+        self._tracing = False
+        self._trace_lock = threading.Lock()
         if tpl:
             self._register_tpl_globals()
         if http:
@@ -124,7 +413,9 @@ class ConfiguredWebassetsModule(ConfiguredModule):
             ctx.http.response.status = status
             for header, value in headers.items():
                 ctx.http.response.headers[header] = value
-            ctx.http.response.text = body
+            if not isinstance(body, bytes):
+                body = bytes(body)
+            ctx.http.response.body = body
 
         @webassets.vars2url
         def _webassets_vars2url(ctx, module, paths):
@@ -132,16 +423,150 @@ class ConfiguredWebassetsModule(ConfiguredModule):
 
         @webassets.match2vars
         def _webassets_match2vars(ctx, matches):
+            path = matches['path']
+            if self.url_style == 'path':
+                match = _path_hash_regex.match(path)
+                if match:
+                    path = match.group(2)
             return {
                 'module': matches['module'],
-                'paths': matches['path'],
+                'paths': path,
             }
 
     def _finalize(self, score):
-        self.proxies = dict(
-            (module, score._modules[module].score_webassets_proxy())
-            for module in self.modules)
+        # proxies are created on first use of their module (see _get_proxy),
+        # to keep the startup of processes, that never serve any assets, cheap.
+        self._score = score
+        self.proxies = {}
+        if self._warmup == 'finalize':
+            self.warmup()
+        elif self._warmup:
+            self.warmup(background=True)
+
+    def warmup(self, background=False):
+        """
+        Calculates the hashes of all :meth:`default assets
+        <WebassetsProxy.iter_default_paths>` and :meth:`default bundles
+        <WebassetsProxy.iter_default_bundle_paths>` and writes them to the
+        *rootdir*. Requests arriving in the meantime will wait for the
+        operations already in progress instead of repeating them.
+
+        The operation is performed in a separate daemon thread, if
+        *background* is `True`. The return value is a :class:`WarmupStatus`,
+        which is also available as :attr:`warmup_status`.
+        """
+        status = WarmupStatus()
+        self.warmup_status = status
+        if background:
+            thread = threading.Thread(
+                target=self._perform_warmup, args=(status,),
+                name='score.webassets.warmup', daemon=True)
+            thread.start()
+        else:
+            self._perform_warmup(status)
+        return status
+
+    def _perform_warmup(self, status):
+        try:
+            jobs = []
+            for module in self.modules:
+                try:
+                    jobs.extend(self._list_warmup_jobs(module))
+                except Exception as e:
+                    status.errors.append((module, None, e))
+            status.total = len(jobs)
+            for module, paths, job in jobs:
+                try:
+                    job()
+                except Exception as e:
+                    status.errors.append((module, paths, e))
+                status.done += 1
+        finally:
+            status.finished.set()
+
+    def _list_warmup_jobs(self, module):
+        jobs = []
+        proxy = self._get_proxy(module)
+        for path in self._get_proxy_default_paths(proxy):
+            jobs.append((module, [path], functools.partial(
+                self.get_asset_url, module, path)))
+        if self.rootdir:
+            for chunk in self.get_bundle_chunks(module):
+                if len(chunk) < 2:
+                    continue
+                jobs.append((module, chunk, functools.partial(
+                    self.get_bundle_url, module, chunk)))
+        return jobs
 
+    def prepare_for_fork(self):
+        """
+        Performs all expensive operations of this module up front and
+        prepares the resulting data structures for being shared with forked
+        worker processes. This should be called in the master process of a
+        pre-forking server right before the workers are forked.
+
+        This performs a synchronous :meth:`warmup` and also prepares the
+        responses for all default assets and bundles, so workers can answer
+        requests for them without any file system access. If a
+        :attr:`body_cache` is configured, the bodies are stored there,
+        otherwise they are kept in memory. Afterwards, the caches are
+        compacted and all objects are moved to the permanent generation of
+        the garbage collector (see :func:`gc.freeze`), so the workers do not
+        write to--and thus copy--the memory pages holding them.
+
+        Calculated hashes are only cached, if :confkey:`freeze` is enabled.
+        The return value is the :class:`WarmupStatus` of the warm-up.
+        """
+        if self.warmup_status is not None:
+            # a background warm-up must not be running at the time of the fork
+            self.warmup_status.wait()
+        status = self.warmup()
+        failed = set((module, None if paths is None else tuple(paths))
+                     for module, paths, _ in status.errors)
+        for module in self.modules:
+            if (module, None) in failed:
+                # listing the module's assets failed during the warm-up
+                continue
+            for module, paths, job in self._list_warmup_jobs(module):
+                if (module, tuple(paths)) in failed:
+                    continue
+                try:
+                    self._preload_response(job())
+                except Exception as e:
+                    status.errors.append((module, paths, e))
+        self._compact_caches()
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        return status
+
+    def _preload_response(self, url):
+        urlpath, _, query = url.partition('?')
+        module, path, hash_ = self._parse_url(urlpath, dict(parse_qsl(query)))
+        loader = self._get_loader(module, path)
+        self._create_immutable_response((module, path, hash_, False), loader)
+        if self.body_cache is not None:
+            self._create_immutable_response(
+                (module, path, hash_, True), loader)
+
+    def _compact_caches(self):
+        """
+        Re-creates the cache dicts and sets, releasing memory over-allocated
+        while they were growing.
+        """
+        for name in ('_frozen_versions', '_asset_sizes', '_inline_tags',
+                     '_bundle_contents',
+                     '_response_cache', '_immutable_headers',
+                     '_proxy_valid_paths',
+                     '_proxy_default_paths', '_proxy_default_bundle_paths'):
+            value = getattr(self, name, None)
+            if value is not None:
+                setattr(self, name, dict(value))
+        self._known_files = set(self._known_files)
+        self._current_files = dict(self._current_files)
+        self._bundle_indexes = set(self._bundle_indexes)
+
+    @_traced('link')
     def generate_html_tag(self, module, *paths, **kwargs):
         """
         Generates the necessary HTML tag(s) for loading given assets with a
@@ -149,10 +574,31 @@ class ConfiguredWebassetsModule(ConfiguredModule):
         ``<link rel="stylesheet" href="...">`` for including css, for example.
 
         Any additional keyword-arguments will be passed to the proxy's
-        render_url() method.
+        :meth:`render_typed_url() <WebassetsProxy.render_typed_url>` method.
+
+        If called within a deferred :meth:`collect` block, the assets are
+        merely registered and a placeholder is returned instead.
+
+        Assets smaller than the configured :confkey:`tpl.inline_threshold`
+        are embedded into the page instead (see
+        :meth:`WebassetsProxy.render_inline`).
         """
+        collector = self._collector.get()
+        if collector is not None and collector.deferred:
+            if not paths:
+                proxy = self._get_proxy(module)
+                paths = self._get_proxy_default_bundle_paths(proxy)
+            else:
+                self._get_proxy(module, *paths)
+            return collector.defer(module, paths, kwargs)
         if not paths:
             proxy = self._get_proxy(module)
+            if self.tpl_autobundle and self.tpl_chunk_size:
+                return ''.join(
+                    self._render_url_tag(
+                        proxy, module, chunk, proxy.bundle_mimetype(chunk),
+                        kwargs)
+                    for chunk in self.get_bundle_chunks(module))
             if self.tpl_autobundle:
                 paths = self._get_proxy_default_bundle_paths(proxy)
             else:
@@ -161,16 +607,127 @@ class ConfiguredWebassetsModule(ConfiguredModule):
                 return ''
         else:
             proxy = self._get_proxy(module, *paths)
+            if self.tpl_autobundle:
+                return self._render_bundle_tags(proxy, module, paths, kwargs)
         if self.tpl_autobundle:
-            url = self.http.url(None, 'score.webassets', module, paths)
-            return proxy.render_url(url, **kwargs)
+            return self._render_url_tag(
+                proxy, module, paths, proxy.bundle_mimetype(paths), kwargs)
         else:
+            if self.freeze and len(paths) > 1:
+                # calculates all hashes and writes all files in one go, the
+                # loop below will just hit the caches. the rootdir is not
+                # scanned, though: that would be too expensive for a page
+                # rendering.
+                self._get_asset_urls(module, paths, scan=False)
             parts = []
             for path in paths:
-                url = self.http.url(None, 'score.webassets', module, [path])
-                parts.append(proxy.render_url(url, **kwargs))
+                parts.append(self._render_url_tag(
+                    proxy, module, [path], proxy.mimetype(path), kwargs))
             return ''.join(parts)
 
+    def _render_bundle_tags(self, proxy, module, paths, kwargs,
+                            collector=None):
+        if self.bundle_planner:
+            parts = self.bundle_planner.split(module, paths)
+        else:
+            parts = [paths]
+        return ''.join(
+            self._render_url_tag(
+                proxy, module, part, proxy.bundle_mimetype(part), kwargs,
+                collector)
+            for part in parts)
+
+    def _render_url_tag(self, proxy, module, paths, mimetype, kwargs,
+                        collector=None):
+        if self.tpl_inline_threshold and \
+                module not in self.tpl_inline_exclude:
+            tag = self._render_inline_tag(proxy, module, paths, mimetype)
+            if tag is not None:
+                return tag
+        url = self.http.url(None, 'score.webassets', module, paths)
+        if collector is None:
+            collector = self._collector.get()
+        if collector is not None:
+            collector.add_url(url, proxy.preload_type(mimetype))
+        return proxy.render_typed_url(url, mimetype, **kwargs)
+
+    def _render_inline_tag(self, proxy, module, paths, mimetype):
+        """
+        Returns the HTML embedding the asset (or bundle) with given *paths*
+        directly, or `None` if it should be loaded via its URL. The decision
+        is cached per :term:`asset hash`, so the content is only rendered
+        once for each version of the asset.
+        """
+        if len(paths) == 1:
+            hash_ = self.get_asset_hash(module, paths[0])
+        else:
+            hash_ = self.get_bundle_hash(module, paths)
+        key = (module, tuple(paths), hash_)
+        try:
+            return self._inline_tags[key]
+        except KeyError:
+            pass
+        tag = None
+        # the sizes of the separate assets are cached, too. this avoids
+        # rendering large assets (and bundles thereof) over and over again.
+        size = sum(self._get_asset_size(proxy, module, path)
+                   for path in paths)
+        if size <= self.tpl_inline_threshold:
+            if len(paths) == 1:
+                content = self._proxy_render(proxy, module, paths[0])
+            else:
+                content = self._create_bundle(proxy, module, paths)
+            encoded = _encode(content)
+            if len(encoded) <= self.tpl_inline_threshold:
+                if _is_text(mimetype) and not isinstance(content, str):
+                    content = str(encoded, 'UTF-8')
+                tag = proxy.render_inline(content, mimetype)
+        self._inline_tags[key] = tag
+        return tag
+
+    def _render_deferred(self, collector, module, paths, kwargs):
+        proxy = self._get_proxy(module)
+        return self._render_bundle_tags(
+            proxy, module, paths, kwargs, collector)
+
+    @contextlib.contextmanager
+    def collect(self, deferred=False):
+        """
+        A context manager recording all asset URLs, that were emitted by
+        :meth:`generate_html_tag` while it was active. It yields an
+        :class:`AssetCollector`, that can be used to tell the browser about
+        these assets before it even parses the HTML body:
+
+        .. code-block:: python
+
+            with webassets.collect() as collected:
+                html = tpl.render('index.jinja2')
+            for value in collected.link_headers():
+                response.headers.add('Link', value)
+
+        If *deferred* is `True`, calls to :meth:`generate_html_tag` will not
+        emit any tags. They will instead register the requested assets and
+        return a placeholder on the first call for each module. The
+        :meth:`AssetCollector.finalize` method will then replace each
+        placeholder with the tags of a single bundle, that contains all
+        assets of that module, that were requested during the rendering:
+
+        .. code-block:: python
+
+            with webassets.collect(deferred=True) as collected:
+                html = collected.finalize(tpl.render('index.jinja2'))
+
+        The collection is bound to the current thread (or asyncio task), so
+        concurrent page renderings do not interfere with each other.
+        """
+        collector = AssetCollector(self, deferred)
+        token = self._collector.set(collector)
+        try:
+            yield collector
+        finally:
+            self._collector.reset(token)
+
+    @_traced('content')
     def generate_html_content(self, module, *paths):
         """
         Generates the necessary HTML tag(s) for including given assets in the
@@ -209,7 +766,7 @@ class ConfiguredWebassetsModule(ConfiguredModule):
         Returns the content of the asset identified my its *module* and *path*.
         """
         proxy = self._get_proxy(module, path)
-        return proxy.render(path)
+        return self._proxy_render(proxy, module, path)
 
     def get_asset_mimetype(self, module, path):
         """
@@ -226,18 +783,302 @@ class ConfiguredWebassetsModule(ConfiguredModule):
         """
         if isinstance(self.freeze, str):
             return self.freeze
-        elif self.freeze:
+        manifest = self._get_manifest()
+        if manifest is not None:
+            try:
+                hash_ = manifest['assets']['%s/%s' % (module, path)]
+            except KeyError:
+                pass
+            else:
+                self._get_proxy(module, path)
+                return hash_
+        if self.freeze:
             key = '%s/%s' % (module, path)
             try:
-                return self._frozen_versions[key]
+                hash_ = self._frozen_versions[key]
             except KeyError:
                 proxy = self._get_proxy(module, path)
-                hash_ = proxy.hash(path)
-                self._frozen_versions[key] = hash_
-                return hash_
+                return self._freeze_version(
+                    key, lambda: self._proxy_hash(proxy, module, path))
+            if self._tracing:
+                with self._trace('hash', module, (path,), 'hit'):
+                    pass
+            return hash_
         else:
             proxy = self._get_proxy(module, path)
-            return proxy.hash(path)
+            return self._proxy_hash(proxy, module, path)
+
+    def _proxy_hash(self, proxy, module, path):
+        with self._trace('hash', module, (path,), 'miss'):
+            hash_ = proxy.hash(path)
+        self.dependency_graph.update(
+            module, path, proxy.dependencies(path))
+        return hash_
+
+    def invalidate(self, module, path, rebuild=False):
+        """
+        Discards the :ref:`frozen <webassets_freezing>` hashes of the asset
+        with given *module* and *path*, as well as those of all assets, that
+        depend on it according to the :attr:`dependency_graph`, and of all
+        bundles containing any of these assets. The *path* need not denote an
+        asset: it may be any source reported by
+        :meth:`WebassetsProxy.dependencies`, like a partial template.
+
+        The hashes are re-calculated the next time they are needed, or
+        immediately, if *rebuild* is `True`. In the latter case, the affected
+        assets and bundles are also written to the *rootdir*.
+
+        Returns the set of affected asset paths. Note that this function has
+        no effect, if the freeze value is a string.
+        """
+        affected = self.dependency_graph.dependents(module, path)
+        affected.add(path)
+        asset_prefix = '%s/' % (module,)
+        bundle_prefix = '%s/bundle\0' % (module,)
+        assets = set()
+        bundles = []
+        for key in list(self._frozen_versions):
+            if key.startswith(bundle_prefix):
+                paths = key[len(bundle_prefix):].split('\0')
+                if affected.intersection(paths):
+                    self._frozen_versions.pop(key, None)
+                    bundles.append(paths)
+            elif key.startswith(asset_prefix):
+                asset_path = key[len(asset_prefix):]
+                if asset_path in affected:
+                    self._frozen_versions.pop(key, None)
+                    assets.add(asset_path)
+        if rebuild:
+            if assets:
+                self.get_asset_urls(module, sorted(assets))
+            if self.rootdir:
+                for paths in bundles:
+                    self.get_bundle_url(module, paths)
+        return assets
+
+    def _proxy_render(self, proxy, module, path):
+        with self._trace('render', module, (path,)):
+            return proxy.render(path)
+
+    def get_asset_hashes(self, module, paths):
+        """
+        Provides the :term:`hashes <asset hash>` of multiple assets in given
+        *module* as a list. This is more efficient than calling
+        :meth:`get_asset_hash` for each path, since all paths are validated at
+        once and the hashes are calculated with a single call to the proxy's
+        :meth:`WebassetsProxy.hashes`.
+        """
+        paths = list(paths)
+        if isinstance(self.freeze, str):
+            self._get_proxy(module, *paths)
+            return [self.freeze] * len(paths)
+        proxy = self._get_proxy(module, *paths)
+        manifest = self._get_manifest()
+        if manifest is not None:
+            assets = manifest['assets']
+            hashes = [assets.get('%s/%s' % (module, path)) for path in paths]
+            if None not in hashes:
+                return hashes
+        if not self.freeze:
+            with self._trace('hash', module, paths, 'miss'):
+                hashes = list(proxy.hashes(paths))
+            for path in paths:
+                self.dependency_graph.update(
+                    module, path, proxy.dependencies(path))
+            return hashes
+        keys = ['%s/%s' % (module, path) for path in paths]
+        missing = [path for path, key in zip(paths, keys)
+                   if key not in self._frozen_versions]
+        if missing:
+            with self._trace('hash', module, missing, 'miss'):
+                hashes = proxy.hashes(missing)
+            for path in missing:
+                self.dependency_graph.update(
+                    module, path, proxy.dependencies(path))
+            for path, hash_ in zip(missing, hashes):
+                self._frozen_versions.setdefault(
+                    '%s/%s' % (module, path), hash_)
+        return [self._frozen_versions[key] for key in keys]
+
+    def get_asset_urls(self, module, paths):
+        """
+        Returns the URLs of multiple assets in given *module* as a list. The
+        result is the same as calling :meth:`get_asset_url` for each path, but
+        the hashes are calculated in a batch (see :meth:`get_asset_hashes`)
+        and the existing files in the *rootdir* are determined with a single
+        directory scan.
+        """
+        return self._get_asset_urls(module, paths)
+
+    def _get_asset_urls(self, module, paths, scan=True):
+        paths = list(paths)
+        hashes = self.get_asset_hashes(module, paths)
+        self._write_assets(
+            self._get_proxy(module), module, paths, hashes, scan)
+        return [self._format_url(module, path, hash_)
+                for path, hash_ in zip(paths, hashes)]
+
+    def _write_assets(self, proxy, module, paths, hashes, scan=True):
+        if not self.rootdir:
+            return
+        if scan:
+            self._scan_rootdir(module)
+        for path, hash_ in zip(paths, hashes):
+            if not hash_:
+                continue
+            file = os.path.join(self.rootdir, module, path, hash_)
+            if file in self._known_files:
+                continue
+            self._write_file(
+                module, file, functools.partial(proxy.mimetype, path),
+                functools.partial(self._proxy_render, proxy, module, path))
+
+    def _get_manifest(self):
+        """
+        Returns the contents of the configured :confkey:`manifest` file, or
+        `None`. The file's modification time is checked at most once per
+        second.
+        """
+        if not self.manifest:
+            return None
+        now = time.monotonic()
+        if now - self._manifest_checked < 1:
+            return self._manifest
+        self._manifest_checked = now
+        try:
+            mtime = os.stat(self.manifest).st_mtime_ns
+        except FileNotFoundError:
+            return self._manifest
+        if mtime != self._manifest_mtime:
+            try:
+                with open(self.manifest) as fp:
+                    self._manifest = json.load(fp)
+                self._manifest_mtime = mtime
+            except ValueError:
+                # the file is probably being written right now
+                pass
+        return self._manifest
+
+    def build_manifest(self):
+        """
+        Calculates the hashes of all :meth:`default assets
+        <WebassetsProxy.iter_default_paths>` and :meth:`default bundles
+        <WebassetsProxy.iter_default_bundle_paths>` of all modules and writes
+        them to the *rootdir*. Returns a manifest `dict`, that can be passed
+        to :meth:`write_manifest`.
+
+        Hashes present in the configured :confkey:`manifest` file are ignored
+        during the calculation.
+        """
+        manifest_file = self.manifest
+        self.manifest = None
+        try:
+            manifest = {'assets': {}, 'bundles': {}}
+            for module in self.modules:
+                proxy = self._get_proxy(module)
+                paths = self._get_proxy_default_paths(proxy)
+                hashes = self.get_asset_hashes(module, paths)
+                self._write_assets(proxy, module, paths, hashes)
+                for path, hash_ in zip(paths, hashes):
+                    manifest['assets']['%s/%s' % (module, path)] = hash_
+                if not self.rootdir:
+                    continue
+                for chunk in self.get_bundle_chunks(module):
+                    if len(chunk) < 2:
+                        continue
+                    name = self.get_bundle_name(module, chunk)
+                    hash_ = self.get_bundle_hash(module, chunk)
+                    self._write_bundle(proxy, module, chunk, name, hash_)
+                    manifest['bundles']['%s/%s' % (module, name)] = {
+                        'paths': list(chunk),
+                        'hash': hash_,
+                    }
+            return manifest
+        finally:
+            self.manifest = manifest_file
+
+    def manifest_from_rootdir(self, rootdir=None):
+        """
+        Creates a manifest `dict` (see :meth:`build_manifest`) describing the
+        files in given *rootdir*, which defaults to the configured one. If an
+        asset or bundle is present in multiple versions, the one with the
+        most recent modification time is used: existing files are touched
+        whenever they become the current version again.
+        """
+        if rootdir is None:
+            rootdir = self.rootdir
+        manifest = {'assets': {}, 'bundles': {}}
+        for module in sorted(os.listdir(rootdir)):
+            folder = os.path.join(rootdir, module)
+            if not os.path.isdir(folder):
+                continue
+            for dirpath, dirnames, filenames in os.walk(folder):
+                hashes = [name for name in filenames
+                          if _hash_regex.match(name)]
+                if not hashes:
+                    continue
+                hash_ = max(hashes, key=lambda name: os.path.getmtime(
+                    os.path.join(dirpath, name)))
+                path = os.path.relpath(dirpath, folder).replace(os.sep, '/')
+                key = '%s/%s' % (module, path)
+                if 'index.json' in filenames:
+                    with open(os.path.join(dirpath, 'index.json')) as fp:
+                        paths = json.load(fp)['paths']
+                    manifest['bundles'][key] = {
+                        'paths': paths,
+                        'hash': hash_,
+                    }
+                else:
+                    manifest['assets'][key] = hash_
+        return manifest
+
+    def diff_manifests(self, old, new):
+        """
+        Compares two manifest dicts and returns a list of 2-tuples
+        ``(change, url)``, where *change* is one of the strings ``added``,
+        ``changed`` and ``removed`` and *url* is the URL of the asset or
+        bundle, as it would be generated by :meth:`get_asset_url` or
+        :meth:`get_bundle_url`. Removed entries are reported with their old
+        URL.
+        """
+        result = []
+        for section in ('assets', 'bundles'):
+            old_entries = old.get(section, {})
+            new_entries = new.get(section, {})
+            for key in sorted(set(old_entries) | set(new_entries)):
+                old_hash = self._manifest_entry_hash(old_entries.get(key))
+                new_hash = self._manifest_entry_hash(new_entries.get(key))
+                if old_hash == new_hash:
+                    continue
+                module, path = key.split('/', maxsplit=1)
+                if section == 'bundles':
+                    path = '__bundle_%s__' % (path,)
+                if new_hash is None:
+                    change = 'removed'
+                    url = self._format_url(module, path, old_hash)
+                else:
+                    change = 'changed' if old_hash else 'added'
+                    url = self._format_url(module, path, new_hash)
+                result.append((change, url))
+        return result
+
+    def _manifest_entry_hash(self, entry):
+        if isinstance(entry, dict):
+            return entry['hash']
+        return entry
+
+    def write_manifest(self, manifest, file=None):
+        """
+        Stores a *manifest*, as returned by :meth:`build_manifest`, in given
+        *file*, which defaults to the configured :confkey:`manifest`. The file
+        is replaced atomically.
+        """
+        if file is None:
+            file = self.manifest
+        tmpfile = '%s.%d.tmp' % (file, os.getpid())
+        with open(tmpfile, 'w') as fp:
+            json.dump(manifest, fp, indent=2, sort_keys=True)
+        os.replace(tmpfile, file)
 
     def get_asset_url(self, module, path):
         """
@@ -246,7 +1087,9 @@ class ConfiguredWebassetsModule(ConfiguredModule):
 
         You won't need this function, if you're using :mod:`score.http`. But if
         your means of deployment is different, you will want to create URLs to
-        your assets using this function. It will look something like this::
+        your assets using this function. It will look something like this
+        (or ``/css/_v0b2931cc6255c72e/reset.css``, if the configured
+        :confkey:`url_style` is ``path``)::
 
             /css/reset.css?_v=0b2931cc6255c72e
 
@@ -269,20 +1112,119 @@ class ConfiguredWebassetsModule(ConfiguredModule):
             ))
         """
         proxy = self._get_proxy(module, path)
-        url = '/%s/%s' % (module, path)
         hash_ = self.get_asset_hash(module, path)
+        url = self._format_url(module, path, hash_)
         if hash_:
-            url += '?_v=' + hash_
             if self.rootdir:
                 file = os.path.join(self.rootdir, module, path, hash_)
-                if not os.path.exists(file):
-                    os.makedirs(os.path.dirname(file), exist_ok=True)
-                    with open(file, 'w') as fp:
-                        fp.write(proxy.mimetype(path))
-                        fp.write('\n')
-                        fp.write(proxy.render(path))
+                self._write_file(
+                    module, file, lambda: proxy.mimetype(path),
+                    lambda: self._proxy_render(proxy, module, path))
         return url
 
+    def _single_flight(self, key, func):
+        """
+        Invokes *func*, unless another thread is currently doing so for the
+        same *key*. In the latter case, it waits for the other thread to
+        finish and invokes *func* afterwards. The function must thus check
+        whether the work was already done, before doing anything expensive.
+        """
+        with self._inflight_lock:
+            lock = self._inflight.setdefault(key, threading.Lock())
+        with lock:
+            try:
+                return func()
+            finally:
+                with self._inflight_lock:
+                    if self._inflight.get(key) is lock:
+                        del self._inflight[key]
+
+    def _freeze_version(self, key, calculate):
+        def freeze():
+            try:
+                return self._frozen_versions[key]
+            except KeyError:
+                hash_ = calculate()
+                self._frozen_versions[key] = hash_
+                return hash_
+        return self._single_flight(('hash', key), freeze)
+
+    def _write_file(self, module, file, mimetype, render):
+        """
+        Stores an asset or bundle of given *module* in the *rootdir*, unless
+        the *file* already exists. Both *mimetype* and *render* are callables,
+        that are only invoked if the file needs to be written.
+
+        An existing file is touched, if it is not the version this process
+        used last, so the most recently modified file is always the current
+        version (see :meth:`manifest_from_rootdir`), even after reverting an
+        asset to an earlier version.
+        """
+        if self._tracing:
+            relpath = os.path.relpath(
+                file, os.path.join(self.rootdir, module))
+        else:
+            relpath = None
+        if self._current_files.get(os.path.dirname(file)) == file:
+            if self._tracing:
+                with self._trace('write', module, (relpath,), 'hit'):
+                    pass
+            return
+        if file in self._known_files or os.path.exists(file):
+            try:
+                os.utime(file)
+            except FileNotFoundError:
+                self._forget_file(file)
+            else:
+                if self._tracing:
+                    with self._trace('write', module, (relpath,), 'hit'):
+                        pass
+                self._known_files.add(file)
+                self._current_files[os.path.dirname(file)] = file
+                return
+
+        def write():
+            if os.path.exists(file):
+                self._known_files.add(file)
+                return
+            with self._trace('write', module, (relpath,), 'miss'):
+                os.makedirs(os.path.dirname(file), exist_ok=True)
+                tmpfile = '%s.%d.%d.tmp' % (
+                    file, os.getpid(), threading.get_ident())
+                with open(tmpfile, 'wb') as fp:
+                    fp.write(_content_type(mimetype()).encode('UTF-8'))
+                    fp.write(b'\n')
+                    fp.write(_encode(render()))
+                os.replace(tmpfile, file)
+            self._known_files.add(file)
+            self._current_files[os.path.dirname(file)] = file
+        self._single_flight(('file', file), write)
+
+    def _forget_file(self, file):
+        """
+        Removes a *file*, that turned out to be missing, from the caches of
+        :meth:`_write_file`, so it is written anew on the next occasion.
+        """
+        self._known_files.discard(file)
+        folder = os.path.dirname(file)
+        if self._current_files.get(folder) == file:
+            del self._current_files[folder]
+
+    def _scan_rootdir(self, module):
+        """
+        Registers all files of given *module* in the *rootdir* as existing
+        with a single directory traversal, sparing :meth:`_write_file` the
+        check for each file. The traversal is only performed once for each
+        module.
+        """
+        if module in self._scanned_modules:
+            return
+        self._scanned_modules.add(module)
+        folder = os.path.join(self.rootdir, module)
+        for dirpath, dirnames, filenames in os.walk(folder):
+            self._known_files.update(
+                os.path.join(dirpath, filename) for filename in filenames)
+
     def get_bundle_name(self, module, paths=None):
         """
         Provides a unique name for a :term:`bundle <asset bundle>` consisting
@@ -298,8 +1240,12 @@ class ConfiguredWebassetsModule(ConfiguredModule):
             paths = self._get_proxy_default_bundle_paths(proxy)
         elif not paths:
             raise ValueError('No paths provided')
-        return xxhash.xxh64('\0'.join(sorted(paths)).encode('UTF-8'))\
-            .hexdigest()
+        hash = new_hash(self.hash_algorithm)
+        for index, path in enumerate(sorted(paths)):
+            if index:
+                hash.update(b'\0')
+            feed(hash, path)
+        return hash.hexdigest()
 
     def get_bundle_hash(self, module, paths=None):
         """
@@ -315,17 +1261,132 @@ class ConfiguredWebassetsModule(ConfiguredModule):
             raise ValueError('No paths provided')
         if isinstance(self.freeze, str):
             return self.freeze
-        elif self.freeze:
+        manifest = self._get_manifest()
+        if manifest is not None:
+            key = '%s/%s' % (module, self.get_bundle_name(module, paths))
+            try:
+                return manifest['bundles'][key]['hash']
+            except KeyError:
+                pass
+        if self.freeze:
             key = '%s/bundle\0%s' % (module, '\0'.join(paths))
             try:
-                return self._frozen_versions[key]
+                hash_ = self._frozen_versions[key]
             except KeyError:
                 proxy = self._get_proxy(module, *paths)
-                hash_ = proxy.bundle_hash(paths)
-                self._frozen_versions[key] = hash_
-                return hash_
+                return self._freeze_version(
+                    key,
+                    lambda: self._calculate_bundle_hash(proxy, module, paths))
+            if self._tracing:
+                with self._trace('hash', module, paths, 'hit'):
+                    pass
+            return hash_
         proxy = self._get_proxy(module, *paths)
-        return proxy.bundle_hash(paths)
+        return self._calculate_bundle_hash(proxy, module, paths)
+
+    def _calculate_bundle_hash(self, proxy, module, paths):
+        with self._trace('hash', module, paths, 'miss'):
+            hash_ = proxy.bundle_hash(paths)
+        for path in paths:
+            self.dependency_graph.update(
+                module, path, proxy.dependencies(path))
+        transforms = self.transforms.get(module)
+        if not transforms or not hash_:
+            return hash_
+        hash = feed(new_hash(self.hash_algorithm), hash_)
+        for identity, _ in transforms:
+            hash.update(b'\0')
+            feed(hash, identity)
+        return hash.hexdigest()
+
+    def _create_bundle(self, proxy, module, paths):
+        """
+        Creates the content of a bundle, including the effects of all
+        configured :mod:`transforms <score.webassets.transforms>`.
+        """
+        with self._trace('create_bundle', module, paths):
+            content = proxy.create_bundle(paths)
+        transforms = self.transforms.get(module)
+        if not transforms:
+            return content
+        mimetype = proxy.bundle_mimetype(paths)
+        size = len(_encode(content))
+        for identity, transform in transforms:
+            start = time.perf_counter()
+            content = transform(content, mimetype)
+            duration = time.perf_counter() - start
+            size_before, size = size, len(_encode(content))
+            with self._transform_stats_lock:
+                stats = self.transform_stats.setdefault((module, identity), {
+                    'runs': 0,
+                    'seconds': 0.0,
+                    'bytes_before': 0,
+                    'bytes_after': 0,
+                })
+                stats['runs'] += 1
+                stats['seconds'] += duration
+                stats['bytes_before'] += size_before
+                stats['bytes_after'] += size
+        return content
+
+    def get_bundle_chunks(self, module, paths=None, chunk_size=None):
+        """
+        Splits the :term:`bundle <asset bundle>` consisting of given *module*
+        and *paths* into a list of smaller bundles, each containing at most
+        *chunk_size* bytes. Will use the module's :meth:`default paths
+        <WebassetsProxy.iter_default_bundle_paths>`, if *paths* are omitted,
+        and the configured :confkey:`tpl.chunk_size`, if *chunk_size* is
+        omitted.
+
+        The order of the paths is retained, i.e. concatenating the returned
+        lists will yield the original path list. An asset larger than
+        *chunk_size* will end up in a chunk of its own.
+
+        The list is split recursively until all chunks are small enough.
+        Each split happens in front of the path with the lowest checksum in
+        the current range. This way, the boundaries do not depend on the
+        sizes of the assets. Growing an asset only splits the chunks it is
+        part of, and the chunks elsewhere keep their paths and thus their
+        hashes.
+        """
+        if paths is None:
+            proxy = self._get_proxy(module)
+            paths = self._get_proxy_default_bundle_paths(proxy)
+        elif not paths:
+            raise ValueError('No paths provided')
+        else:
+            proxy = self._get_proxy(module, *paths)
+        paths = list(paths)
+        if not paths:
+            return []
+        if chunk_size is None:
+            chunk_size = self.tpl_chunk_size
+        if not chunk_size:
+            return [paths]
+        sizes = [self._get_asset_size(proxy, module, path) for path in paths]
+        ranks = [zlib.crc32(path.encode('UTF-8')) for path in paths]
+        chunks = []
+
+        def split(start, end):
+            if end - start == 1 or sum(sizes[start:end]) <= chunk_size:
+                chunks.append(paths[start:end])
+                return
+            middle = min(range(start + 1, end), key=ranks.__getitem__)
+            split(start, middle)
+            split(middle, end)
+
+        split(0, len(paths))
+        return chunks
+
+    def _get_asset_size(self, proxy, module, path):
+        key = (module, path, self.get_asset_hash(module, path))
+        try:
+            return self._asset_sizes[key]
+        except KeyError:
+            content = self._proxy_render(proxy, module, path)
+            size = len(_encode(content))
+            self._asset_sizes[key] = size
+            return size
 
     def get_bundle_content(self, module, paths=None):
         """
@@ -333,7 +1394,10 @@ class ConfiguredWebassetsModule(ConfiguredModule):
         *module* name is required and will create a bundle with module's
         :meth:`default paths <WebassetsProxy.iter_default_bundle_paths>`. It is
         also possible to create a bundle with a specific list of :term:`asset
-        paths <asset path>`.
+        paths <asset path>`. The configured :mod:`transforms
+        <score.webassets.transforms>` are applied to the content. Since they
+        can be expensive, the transformed content is cached for each version
+        of the bundle.
         """
         if paths is None:
             proxy = self._get_proxy(module)
@@ -342,7 +1406,23 @@ class ConfiguredWebassetsModule(ConfiguredModule):
             raise ValueError('No paths provided')
         else:
             proxy = self._get_proxy(module, *paths)
-        return proxy.create_bundle(paths)
+        if not self.transforms.get(module):
+            return self._create_bundle(proxy, module, paths)
+        key = (module, self.get_bundle_name(module, paths),
+               self.get_bundle_hash(module, paths))
+        try:
+            return self._bundle_contents[key]
+        except KeyError:
+            pass
+
+        def create():
+            try:
+                return self._bundle_contents[key]
+            except KeyError:
+                content = self._create_bundle(proxy, module, paths)
+                self._cache_response(self._bundle_contents, key, content)
+                return content
+        return self._single_flight(('content', key), create)
 
     def get_bundle_url(self, module, paths=None):
         """
@@ -369,17 +1449,181 @@ class ConfiguredWebassetsModule(ConfiguredModule):
                 'Cannot generate bundle url: no rootdir configured')
         bundle_name = self.get_bundle_name(module, paths)
         bundle_hash = self.get_bundle_hash(module, paths)
+        self._write_bundle(proxy, module, paths, bundle_name, bundle_hash)
+        return self._format_url(
+            module, '__bundle_%s__' % (bundle_name,), bundle_hash)
+
+    def _write_bundle(self, proxy, module, paths, bundle_name, bundle_hash):
         file = os.path.join(self.rootdir, module, bundle_name, bundle_hash)
+        self._write_file(
+            module, file, lambda: proxy.bundle_mimetype(paths),
+            lambda: self._create_bundle(proxy, module, paths))
+        self._write_bundle_index(proxy, module, bundle_name, paths)
+
+    def get_bundle_urls(self, module, path_lists):
+        """
+        Returns the URLs of multiple bundles in given *module*, each
+        consisting of one of the given *path_lists*. This is the batch
+        variant of :meth:`get_bundle_url`.
+        """
+        path_lists = [list(paths) for paths in path_lists]
+        all_paths = set(path for paths in path_lists for path in paths)
+        self._get_proxy(module, *all_paths)
+        if self.rootdir:
+            self._scan_rootdir(module)
+        return [self.get_bundle_url(module, paths) for paths in path_lists]
+
+    def _write_bundle_index(self, proxy, module, bundle_name, paths):
+        """
+        Stores the paths of a bundle next to its files in the *rootdir*. This
+        allows re-creating the bundle when only its name is known, i.e. when
+        a bundle is requested from a process, that did not create its URL.
+        """
+        key = (module, bundle_name)
+        if key in self._bundle_indexes:
+            return
+        file = os.path.join(self.rootdir, module, bundle_name, 'index.json')
         if not os.path.exists(file):
-            os.makedirs(os.path.dirname(file), exist_ok=True)
-            with open(file, 'w') as fp:
-                fp.write(proxy.bundle_mimetype(paths))
-                fp.write('\n')
-                fp.write(proxy.create_bundle(paths))
-        url = '/%s/__bundle_%s__' % (module, bundle_name,)
-        if bundle_hash:
-            url += '?_v=' + bundle_hash
-        return url
+            tmpfile = '%s.%d.%d.tmp' % (
+                file, os.getpid(), threading.get_ident())
+            with open(tmpfile, 'w') as fp:
+                json.dump({
+                    'paths': list(paths),
+                    'mimetype': proxy.bundle_mimetype(paths),
+                }, fp)
+            os.replace(tmpfile, file)
+        self._bundle_indexes.add(key)
+
+    def _read_bundle_index(self, module, bundle_name):
+        if module not in self.modules or not self.rootdir:
+            return None
+        file = os.path.join(self.rootdir, module, bundle_name, 'index.json')
+        try:
+            with open(file) as fp:
+                return json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _recreate_bundle(self, module, bundle_name, hash_):
+        """
+        Creates a bundle, that was requested with an unknown *hash_* (or no
+        hash at all), using the persisted bundle index. Raises
+        :class:`_BundleMoved` if the requested hash is not the current hash
+        of the bundle.
+        """
+        index = self._read_bundle_index(module, bundle_name)
+        if index is None:
+            raise AssetNotFound(
+                module, 'bundle(%s)@%s' % (bundle_name, hash_))
+        paths = index['paths']
+        current_hash = self.get_bundle_hash(module, paths)
+        if hash_ and hash_ != current_hash:
+            raise _BundleMoved(module, bundle_name, current_hash)
+        self.get_bundle_url(module, paths)
+        file = os.path.join(self.rootdir, module, bundle_name, current_hash)
+        return self._read_file(file)
+
+    def _read_file(self, file):
+        """
+        Reads an asset or bundle, that was stored in the *rootdir*, and
+        returns its content type and its content as `bytes`. The content is
+        not decoded, the content type declares its charset instead.
+        """
+        with open(file, 'rb') as fp:
+            content_type = fp.readline()[:-1].decode('UTF-8')
+            return content_type, fp.read()
+
+    def _format_url(self, module, path, hash_):
+        if not hash_:
+            return '/%s/%s' % (module, path)
+        if self.url_style == 'path':
+            return '/%s/_v%s/%s' % (module, hash_, path)
+        return '/%s/%s?_v=%s' % (module, path, hash_)
+
+    def _parse_url(self, path, query):
+        """
+        Reverse operation of :meth:`_format_url`: splits a URL *path* (and the
+        already parsed *query*) into a 3-tuple ``(module, path, hash)``. The
+        hash will be `None`, if the URL does not contain any.
+        """
+        module, path = path.lstrip('/').split('/', maxsplit=1)
+        hash_ = query.get('_v', None)
+        if self.url_style == 'path':
+            match = _path_hash_regex.match(path)
+            if match:
+                hash_, path = match.groups()
+        return module, path, hash_
+
+    def export(self, folder):
+        """
+        Writes all :meth:`default assets <WebassetsProxy.iter_default_paths>`
+        and the :meth:`default bundle
+        <WebassetsProxy.iter_default_bundle_paths>` of every configured module
+        into given *folder*, so a web server can deliver them without invoking
+        python at all. If a :confkey:`tpl.chunk_size` is configured, the
+        bundle's :meth:`chunks <get_bundle_chunks>` are written instead.
+
+        Every URL as returned by :meth:`get_asset_url` or
+        :meth:`get_bundle_url` is stored in a file named after its hash, with
+        an extension matching its mime type::
+
+            /css/reset.css?_v=0b2931cc6255c72e
+              -> css/reset.css/0b2931cc6255c72e.css
+
+        A gzip-compressed sibling (with the additional extension ``.gz``) is
+        written for each file, that benefits from compression.
+
+        The return value is a list of 2-tuples mapping each exported URL to
+        the path of its file relative to *folder*. Assets without a hash are
+        not exported, since they cannot be cached forever.
+        """
+        exported = []
+        for module in self.modules:
+            proxy = self._get_proxy(module)
+            for path in self._get_proxy_default_paths(proxy):
+                url = self.get_asset_url(module, path)
+                file = self._export_file(
+                    folder, url, path, proxy.mimetype(path),
+                    lambda: self._proxy_render(proxy, module, path))
+                if file:
+                    exported.append((url, file))
+            if not self.rootdir:
+                continue
+            for paths in self.get_bundle_chunks(module):
+                if len(paths) < 2:
+                    continue
+                url = self.get_bundle_url(module, paths)
+                file = self._export_file(
+                    folder, url, None, proxy.bundle_mimetype(paths),
+                    lambda: self._create_bundle(proxy, module, paths))
+                if file:
+                    exported.append((url, file))
+        return exported
+
+    def _export_file(self, folder, url, path, mimetype, render):
+        urlpath, _, query = url.partition('?')
+        module, urlpath, hash_ = self._parse_url(
+            urlpath, dict(parse_qsl(query)))
+        if not hash_:
+            return None
+        extension = None
+        if path:
+            extension = os.path.splitext(path)[1]
+        if not extension:
+            extension = mimetypes.guess_extension(mimetype) or ''
+        relpath = os.path.join(module, urlpath, hash_ + extension)
+        file = os.path.join(folder, relpath)
+        if os.path.exists(file):
+            return relpath
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        content = _encode(render())
+        with open(file, 'wb') as fp:
+            fp.write(content)
+        compressed = gzip.compress(content, 9)
+        if len(compressed) < len(content):
+            with open(file + '.gz', 'wb') as fp:
+                fp.write(compressed)
+        return relpath
 
     def get_request_response(self, request):
         """
@@ -388,116 +1632,462 @@ class ConfiguredWebassetsModule(ConfiguredModule):
         ``(status, headers, body)`` containing an HTTP status code, a `dict`
         of HTTP headers and the response body.
         The *headers* list in the latter case is a `dict` mapping header names
-        to their values, whereas the *body* is just a string. Note that none of
-        the return values are formatted in any way. They will need to be
-        properly encoded (which should happen automatically in most
-        frameworks).
+        to their values, whereas the *body* is always a bytes-like object
+        (`bytes` or `memoryview`), that can be sent as-is. The Content-Type
+        header declares the charset of textual assets.
+
+        Responses to requests for hashed URLs are immutable and thus created
+        only once: the returned *headers* are shared between requests and
+        must not be modified.
+
+        Requests for bundles, that are not present in the *rootdir*, are
+        answered by re-creating the bundle, if the requested hash is still
+        valid. A request for an outdated hash of a bundle is redirected to the
+        URL of the current version.
         """
         try:
-            module, path = request.path.lstrip('/').split('/', maxsplit=1)
-            if path.startswith('__bundle_') and path.endswith('__'):
-                def loader(hash_=None):
-                    name = path[len('__bundle_'):-2]
-                    if not hash_:
-                        raise AssetNotFound(module,
-                                            'bundle(%s)@None' % (name,))
+            module, path, hash_ = self._parse_url(request.path, request.GET)
+            return self._get_common_response(
+                request, module, path, hash_, self._get_loader(module, path))
+        except _BundleMoved as moved:
+            # the location is relative to the requested URL, since we do not
+            # know the prefix the assets are served under.
+            if '_v' in request.GET:
+                location = '__bundle_%s__?_v=%s' % (moved.name, moved.hash)
+            else:
+                location = '../_v%s/__bundle_%s__' % (moved.hash, moved.name)
+            return 307, {
+                'Location': location,
+                'Cache-Control': 'no-cache',
+            }, b''
+        except AssetNotFound:
+            return 404, {}, b''
+
+    def _get_loader(self, module, path):
+        """
+        Returns a function loading the content type and the body of the asset
+        (or bundle) with given URL *path*, optionally accepting a hash.
+        """
+        if path.startswith('__bundle_') and path.endswith('__'):
+            def loader(hash_=None):
+                name = path[len('__bundle_'):-2]
+                if hash_ and self.rootdir:
                     file = os.path.join(self.rootdir, module, name, hash_)
                     try:
-                        content = open(file).read()
+                        return self._read_file(file)
                     except FileNotFoundError:
-                        raise AssetNotFound(module,
-                                            'bundle(%s)@%s' % (name, hash_))
-                    return content.split('\n', maxsplit=1)
-            else:
-                def loader(hash_=None):
-                    if hash_ and self.rootdir:
-                        file = os.path.join(self.rootdir, module, path, hash_)
-                        try:
-                            content = open(file).read()
-                        except FileNotFoundError:
-                            raise AssetNotFound(module,
-                                                '%s@%s' % (path, hash_))
-                        return content.split('\n', maxsplit=1)
-                    proxy = self._get_proxy(module, path)
-                    return proxy.mimetype(path), proxy.render(path)
-            return self._get_common_response(request, module, path, loader)
-        except AssetNotFound:
-            return 404, {}, ''
-
-    def _get_common_response(self, request, module, path, loader):
-        headers = dict((key.lower(), value)
-                       for key, value in request.headers.items())
-        if '_v' in request.GET:
-            can_send_304 = (
-                'if-none-match' in headers or
-                'if-modified-since' in headers)
+                        # the file might have been deleted after it was
+                        # written, re-create it below.
+                        self._forget_file(file)
+                return self._recreate_bundle(module, name, hash_)
+        else:
+            def loader(hash_=None):
+                if hash_ and self.rootdir:
+                    file = os.path.join(self.rootdir, module, path, hash_)
+                    try:
+                        return self._read_file(file)
+                    except FileNotFoundError:
+                        self._forget_file(file)
+                    # the file of the current version might have been deleted
+                    # after it was written, all others are gone for good.
+                    if hash_ != self.get_asset_hash(module, path):
+                        raise AssetNotFound(module, '%s@%s' % (path, hash_))
+                    self.get_asset_url(module, path)
+                    return self._read_file(file)
+                proxy = self._get_proxy(module, path)
+                return (_content_type(proxy.mimetype(path)),
+                        _encode(self._proxy_render(proxy, module, path)))
+        return loader
+
+    def _get_common_response(self, request, module, path, hash_, loader):
+        # only three request headers are relevant, there is no need to
+        # normalize all of them.
+        if_none_match = if_modified_since = accept_encoding = None
+        for key, value in request.headers.items():
+            key = key.lower()
+            if key == 'if-none-match':
+                if_none_match = value
+            elif key == 'if-modified-since':
+                if_modified_since = value
+            elif key == 'accept-encoding':
+                accept_encoding = value
+        if hash_ is not None:
             # it really doesn't matter what the values of these headers are,
             # they merely indicate that the resource was requested by the
             # client earlier and it is now checking for changes. but since
             # assets with hashes are immutable, we can always respond with 304.
-            if can_send_304:
-                return 304, {}, ''
-            hash_ = request.GET['_v']
-            if not re.match(r'^[0-9a-f]+$', hash_):
-                raise AssetNotFound(module, path)
+            if if_none_match is not None or if_modified_since is not None:
+                return 304, {}, b''
+            accept_gzip = (self.body_cache is not None and
+                           accept_encoding is not None and
+                           'gzip' in accept_encoding)
+            key = (module, path, hash_, accept_gzip)
             try:
-                mimetype, body = loader(hash_)
-            except FileNotFoundError:
+                return self._response_cache[key]
+            except KeyError:
+                pass
+            if not _hash_regex.match(hash_):
                 raise AssetNotFound(module, path)
-            year = 60 * 60 * 24 * 30 * 12
-            return 200, {
-                'Content-Type': mimetype,
-                'Cache-Control': 'max-age=%d, s-max-age=%d' % (year, year),
-                'Etag': hash_,
-                'Last-Modified': email.utils.formatdate(),
-            }, body
-        if 'if-modified-since' in headers and self.rootdir:
-            t = time.mktime(email.utils.parsedate(
-                headers['if-modified-since']))
+            return self._create_immutable_response(key, loader)
+        if if_modified_since is not None and self.rootdir:
+            t = time.mktime(email.utils.parsedate(if_modified_since))
             getmtime = os.path.getmtime
             folder = os.path.join(self.rootdir, module, path)
             try:
                 if not any(getmtime(f) > t for f in os.listdir(folder)):
                     # there aren't any newer files in this folder
-                    return 304, {}, ''
+                    return 304, {}, b''
             except FileNotFoundError:
                 # folder does not exist, ignore
                 pass
-        hash_ = request.GET.get('_v', None)
         mimetype, body = loader(hash_)
         headers = {
-            'Content-Type': mimetype,
+            'Content-Type': _content_type(mimetype),
             'Last-Modified': email.utils.formatdate(),
         }
         if hash_:
             headers['Etag'] = hash_
         return 200, headers, body
 
+    def _create_immutable_response(self, key, loader):
+        """
+        Creates the response to a request for a hashed asset or bundle. The
+        *key* is a 4-tuple ``(module, path, hash, accept_gzip)``.
+
+        Since these responses never change, the headers are calculated only
+        once for each key. The whole response is cached as well, unless a
+        :attr:`body_cache` is configured, which keeps the bodies out of the
+        memory of the process. The Last-Modified header contains the time
+        the asset was written to the *rootdir* (or the time the response was
+        first created, if there is no *rootdir*).
+
+        Only responses for hashes, that are stored in the *rootdir* or match
+        the current hash of the asset, are cached: the hash is chosen by the
+        client, after all. The number of cached responses is limited, too.
+        """
+        module, path, hash_, accept_gzip = key
+        # headers are only cached for cacheable versions, so this check
+        # does not touch the file system for known responses
+        cacheable = (
+            (module, path, hash_, None) in self._immutable_headers or
+            (module, path, hash_, 'gzip') in self._immutable_headers or
+            self._is_cacheable_version(module, path, hash_))
+        encoding = None
+        try:
+            if self.body_cache is not None and cacheable:
+                content_type, body, encoding = self._load_cached_body(
+                    module, path, hash_, loader, accept_gzip)
+            else:
+                content_type, body = loader(hash_)
+        except FileNotFoundError:
+            raise AssetNotFound(module, path)
+        body = _encode(body)
+        headers_key = (module, path, hash_, encoding)
+        try:
+            headers = self._immutable_headers[headers_key]
+        except KeyError:
+            headers = {
+                'Content-Type': _content_type(content_type),
+                'Content-Length': str(len(body)),
+                'Cache-Control': _immutable_cache_control,
+                'ETag': '"%s"' % (hash_,),
+                'Last-Modified': email.utils.formatdate(
+                    self._get_materialization_time(module, path, hash_),
+                    usegmt=True),
+            }
+            if self.body_cache is not None:
+                headers['Vary'] = 'Accept-Encoding'
+            if encoding:
+                headers['Content-Encoding'] = encoding
+            if cacheable:
+                self._cache_response(
+                    self._immutable_headers, headers_key, headers)
+        response = (200, headers, body)
+        if self.body_cache is None and cacheable:
+            self._cache_response(self._response_cache, key, response)
+        return response
+
+    def _cache_response(self, cache, key, value):
+        with self._response_cache_lock:
+            while len(cache) >= _response_cache_limit:
+                # dicts retain their insertion order: drop the oldest entry
+                del cache[next(iter(cache))]
+            cache[key] = value
+
+    def _is_cacheable_version(self, module, path, hash_):
+        """
+        Whether the asset (or bundle) with given URL *path* and *hash_* is
+        stored in the *rootdir*, or if *hash_* is its current hash.
+        """
+        file = self._get_stored_file(module, path, hash_)
+        if file and os.path.exists(file):
+            return True
+        try:
+            if path.startswith('__bundle_') and path.endswith('__'):
+                index = self._read_bundle_index(
+                    module, path[len('__bundle_'):-2])
+                if index is None:
+                    return False
+                return self.get_bundle_hash(module, index['paths']) == hash_
+            return self.get_asset_hash(module, path) == hash_
+        except AssetNotFound:
+            return False
+
+    def _get_stored_file(self, module, path, hash_):
+        if not self.rootdir:
+            return None
+        if path.startswith('__bundle_') and path.endswith('__'):
+            path = path[len('__bundle_'):-2]
+        return os.path.join(self.rootdir, module, path, hash_)
+
+    def _get_materialization_time(self, module, path, hash_):
+        file = self._get_stored_file(module, path, hash_)
+        if file:
+            try:
+                return os.path.getmtime(file)
+            except FileNotFoundError:
+                pass
+        return time.time()
+
+    def _load_cached_body(self, module, path, hash_, loader, accept_gzip):
+        """
+        Loads the body of a hashed asset or bundle via the :attr:`body_cache`,
+        invoking the *loader* only if it is not cached, yet. Returns a
+        3-tuple ``(content_type, body, encoding)``, where the *encoding* is
+        either `None` or ``gzip``, if the client accepts gzip and the
+        compressed variant is smaller.
+        """
+        key = (module, path, hash_)
+        if accept_gzip:
+            cached = self.body_cache.get(key + ('gzip',))
+            if cached is not None:
+                return cached + ('gzip',)
+        cached = self.body_cache.get(key + ('identity',))
+        if cached is not None:
+            return cached + (None,)
+        content_type, body = loader(hash_)
+        body = _encode(body)
+        self.body_cache.set(key + ('identity',), content_type, body)
+        if _is_text(content_type):
+            compressed = gzip.compress(body, 9)
+            if len(compressed) < len(body):
+                self.body_cache.set(key + ('gzip',), content_type, compressed)
+                if accept_gzip:
+                    return content_type, compressed, 'gzip'
+        return content_type, body, None
+
     def _get_proxy(self, module, *paths):
         if module not in self.modules:
             if paths:
                 raise ModuleNotConfigured(module, paths[0])
             else:
                 raise ModuleNotConfigured(module)
-        proxy = self.proxies[module]
+        try:
+            proxy = self.proxies[module]
+        except KeyError:
+            proxy = self._score._modules[module].score_webassets_proxy()
+            proxy.hash_algorithm = self.hash_algorithm
+            # the warm-up thread might have been faster
+            proxy = self.proxies.setdefault(module, proxy)
         if self.freeze:
             if not hasattr(self, '_proxy_valid_paths'):
                 self._proxy_valid_paths = {}
             if proxy not in self._proxy_valid_paths:
-                self._proxy_valid_paths[proxy] = []
+                self._proxy_valid_paths[proxy] = set()
             valid_paths = self._proxy_valid_paths[proxy]
             for path in paths:
                 if path in valid_paths:
                     continue
-                if not proxy.validate_path(path):
+                if not self._validate_path(proxy, module, path):
                     raise AssetNotFound(module, path)
-                valid_paths.append(path)
+                valid_paths.add(path)
         else:
             for path in paths:
-                if not proxy.validate_path(path):
+                if not self._validate_path(proxy, module, path):
                     raise AssetNotFound(module, path)
         return proxy
 
+    def _validate_path(self, proxy, module, path):
+        with self._trace('validate_path', module, (path,)):
+            return proxy.validate_path(path)
+
+    def add_trace_hook(self, hook):
+        """
+        Registers a :mod:`trace hook <score.webassets.trace>`, that will be
+        informed about all operations of this module.
+        """
+        with self._trace_lock:
+            self._trace_hooks = self._trace_hooks + [hook]
+            self._tracing = True
+
+    def remove_trace_hook(self, hook):
+        """
+        Removes a hook previously registered via :meth:`add_trace_hook`.
+        """
+        with self._trace_lock:
+            self._trace_hooks = [h for h in self._trace_hooks if h != hook]
+            self._tracing = bool(self._trace_hooks or self._trace_collectors)
+
+    @contextlib.contextmanager
+    def trace(self):
+        """
+        A context manager tracing all operations of the current thread (or
+        asyncio task) while it is active. It yields a
+        :class:`score.webassets.trace.TraceCollector`, that can provide a
+        breakdown of the time spent in each operation:
+
+        .. code-block:: python
+
+            with webassets.trace() as collector:
+                html = tpl.render('index.jinja2')
+            print(collector.dump())
+        """
+        collector = TraceCollector()
+        token = self._trace_collector.set(collector)
+        with self._trace_lock:
+            self._trace_collectors += 1
+            self._tracing = True
+        try:
+            yield collector
+        finally:
+            self._trace_collector.reset(token)
+            with self._trace_lock:
+                self._trace_collectors -= 1
+                self._tracing = bool(
+                    self._trace_hooks or self._trace_collectors)
+
+    def _trace(self, operation, module, paths, cache=None):
+        if not self._tracing:
+            return _no_trace
+        hooks = self._trace_hooks
+        collector = self._trace_collector.get()
+        if collector is not None:
+            hooks = hooks + [collector]
+        if not hooks:
+            return _no_trace
+        return Span(hooks, operation, module, paths, cache)
+
+
+class WarmupStatus:
+    """
+    Progress of a :meth:`ConfiguredWebassetsModule.warmup`.
+
+    .. attribute:: total
+
+        Number of assets and bundles to process, or `None` if the list of
+        assets is not known yet.
+
+    .. attribute:: done
+
+        Number of assets and bundles processed so far.
+
+    .. attribute:: errors
+
+        List of 3-tuples ``(module, paths, exception)`` describing failed
+        operations. The *paths* are `None`, if the assets of the module could
+        not be listed.
+
+    .. attribute:: finished
+
+        A :class:`threading.Event`, that is set once the warm-up is complete.
+    """
+
+    def __init__(self):
+        self.total = None
+        self.done = 0
+        self.errors = []
+        self.finished = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the warm-up is complete, or the optional *timeout* (in
+        seconds) expires. Returns whether the warm-up is complete.
+        """
+        return self.finished.wait(timeout)
+
+
+class AssetCollector:
+    """
+    Stores the asset URLs emitted during a page rendering. See
+    :meth:`ConfiguredWebassetsModule.collect` for usage.
+    """
+
+    def __init__(self, webassets, deferred=False):
+        self._webassets = webassets
+        self.deferred = deferred
+        self._urls = OrderedDict()
+        self._deferred = OrderedDict()
+
+    def add_url(self, url, preload_type=None):
+        """
+        Registers an emitted *url*. The *preload_type* is the value of the
+        ``as`` attribute of a preload link, as returned by
+        :meth:`WebassetsProxy.preload_type`.
+        """
+        self._urls.setdefault(url, preload_type)
+
+    @property
+    def urls(self):
+        """
+        A list of all recorded URLs, in the order they were emitted.
+        """
+        return list(self._urls)
+
+    def link_headers(self):
+        """
+        Returns a list of values for HTTP ``Link`` headers, that instruct the
+        browser to preload the recorded assets. The same list can be sent in a
+        ``103 Early Hints`` response. URLs of assets without a
+        :meth:`preload type <WebassetsProxy.preload_type>` are omitted.
+        """
+        headers = []
+        for url, preload_type in self._urls.items():
+            if not preload_type:
+                continue
+            header = '<%s>; rel=preload; as=%s' % (url, preload_type)
+            if preload_type == 'font':
+                # fonts are always fetched in anonymous mode
+                header += '; crossorigin'
+            headers.append(header)
+        return headers
+
+    def defer(self, module, paths, kwargs):
+        """
+        Registers the *paths* of a *module* for inclusion in the bundle, that
+        will be created in :meth:`finalize`. The keyword arguments *kwargs*
+        for the proxy's render_url() method are taken from the first call for
+        each module. Returns the placeholder, that must be part of the
+        rendered HTML, on the first call for each module, and an empty
+        string on all subsequent calls.
+        """
+        placeholder = ''
+        if module not in self._deferred:
+            self._deferred[module] = (OrderedDict(), kwargs)
+            placeholder = self._placeholder(module)
+        known_paths = self._deferred[module][0]
+        for path in paths:
+            known_paths.setdefault(path)
+        return placeholder
+
+    def finalize(self, html):
+        """
+        Replaces all placeholders in given *html* with the tags loading the
+        assets registered via :meth:`defer` and returns the result. Each
+        module's paths retain the order they were first requested in.
+        """
+        for module, (paths, kwargs) in self._deferred.items():
+            if not paths:
+                # the module has no default paths to render
+                tags = ''
+            else:
+                tags = self._webassets._render_deferred(
+                    self, module, list(paths), kwargs)
+            html = html.replace(self._placeholder(module), tags, 1)
+        return html
+
+    def _placeholder(self, module):
+        return '<!--score.webassets:%s-->' % (module,)
+
 
 class AssetNotFound(Exception):
     """
@@ -514,6 +2104,18 @@ class AssetNotFound(Exception):
         super().__init__('/%s/%s' % (module, path))
 
 
+class _BundleMoved(Exception):
+    """
+    Raised internally when an outdated version of a bundle was requested.
+    """
+
+    def __init__(self, module, name, hash_):
+        self.module = module
+        self.name = name
+        self.hash = hash_
+        super().__init__('/%s/__bundle_%s__' % (module, name))
+
+
 class ModuleNotConfigured(AssetNotFound):
     """
     Raised when an asset in an unconfigured module was requested.
@@ -0,0 +1,208 @@
+# Copyright © 2015-2018 STRG.AT GmbH, Vienna, Austria
+# Copyright © 2018-2020 Necdet Can Ateşman, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in
+# the file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district
+# the Licensee has his registered seat, an establishment or assets.
+
+
+"""
+A cache for response bodies, that is shared among all processes on a host.
+It is enabled with the :confkey:`body_cache` configuration value and
+intended for pre-forking servers: each body (and its compressed variant) is
+stored once per host instead of once per worker process.
+
+The cache is a memory-mapped file consisting of a header, an index of
+fixed-size slots and a data area, that is used as a ring buffer::
+
+    header | bucket 0: slot 0 .. slot 3 | bucket 1: ... | data area
+
+New entries are appended to the data area, overwriting the oldest entries
+once the end is reached. The header contains the logical position of the
+next write (the *head*), which is always increased *before* any data is
+overwritten. Readers do not acquire any lock: they read a slot using a
+sequence counter (a seqlock), copy the referenced data and finally verify,
+that the head has not advanced far enough to overwrite the data in the
+meantime. Writers are serialized with a POSIX record lock on the file.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+_magic = b'SWBC'
+_header = struct.Struct('<4sIIQ')
+_head = struct.Struct('<Q')
+_head_offset = 24
+_header_size = 64
+# sequence counter, key digest, logical data offset, data length and length
+# of the content type, which is stored in front of the body.
+_slot = struct.Struct('<Q16sQIH2x')
+_ways = 4
+
+
+class SharedBodyCache:
+    """
+    A cache mapping keys (tuples of strings) to a content type and a body,
+    backed by a memory-mapped *file*, preferably on a memory file system like
+    ``/dev/shm``. The file is created with room for *size* bytes of data and
+    *slots* index entries, unless it already exists, in which case the
+    dimensions found in the existing file are used.
+
+    All processes opening the same file share the cached bodies, as do all
+    processes forked after the cache was opened.
+    """
+
+    def __init__(self, file, size=64 * 1024 * 1024, slots=4096):
+        self.file = file
+        self._thread_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._fd = os.open(file, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._lock():
+            self._init_file(size, slots)
+        self._mmap = mmap.mmap(self._fd, 0)
+        _, _, self._buckets, self._size = _header.unpack_from(self._mmap, 0)
+        self._data_offset = _header_size + self._buckets * _ways * _slot.size
+
+    def _init_file(self, size, slots):
+        buckets = max(1, slots // _ways)
+        header = os.pread(self._fd, _header.size, 0)
+        if len(header) == _header.size:
+            magic, version, buckets_, size_ = _header.unpack(header)
+            total = _header_size + buckets_ * _ways * _slot.size + size_
+            if magic == _magic and version == 1 and \
+                    os.fstat(self._fd).st_size == total:
+                return
+        total = _header_size + buckets * _ways * _slot.size + size
+        os.ftruncate(self._fd, 0)
+        os.ftruncate(self._fd, total)
+        os.pwrite(self._fd, _header.pack(_magic, 1, buckets, size), 0)
+
+    @contextlib.contextmanager
+    def _lock(self):
+        # record locks only exclude other processes, threads of the same
+        # process need a lock of their own.
+        if self._pid != os.getpid():
+            # the thread lock might have been held by another thread of the
+            # parent process at the time of the fork.
+            self._thread_lock = threading.Lock()
+            self._pid = os.getpid()
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _locate(self, key):
+        digest = hashlib.blake2b(
+            '\0'.join(key).encode('UTF-8'), digest_size=16).digest()
+        bucket = int.from_bytes(digest[:8], 'little') % self._buckets
+        return digest, _header_size + bucket * _ways * _slot.size
+
+    def get(self, key):
+        """
+        Returns a 2-tuple ``(content_type, body)`` stored under given *key*,
+        or `None` if there is no such entry. The *body* is a `bytes` object.
+        """
+        mm = self._mmap
+        size = self._size
+        digest, offset = self._locate(key)
+        for i in range(_ways):
+            slot_offset = offset + i * _slot.size
+            seq, slot_digest, position, length, ctlength = \
+                _slot.unpack_from(mm, slot_offset)
+            if slot_digest != digest or seq % 2:
+                continue
+            start = self._data_offset + position % size
+            data = mm[start:start + length]
+            if _slot.unpack_from(mm, slot_offset)[0] != seq:
+                # the slot was modified while we were reading it
+                return None
+            head, = _head.unpack_from(mm, _head_offset)
+            if head > position + size:
+                # the data was overwritten while we were reading it
+                return None
+            return data[:ctlength].decode('UTF-8'), data[ctlength:]
+        return None
+
+    def set(self, key, content_type, body):
+        """
+        Stores a *body* (a bytes-like object) and its *content_type* under
+        given *key*. Bodies larger than a quarter of the data area are not
+        cached, since they would evict too many other entries.
+        """
+        content_type = content_type.encode('UTF-8')
+        length = len(content_type) + len(body)
+        size = self._size
+        if length > size // 4:
+            return
+        mm = self._mmap
+        digest, offset = self._locate(key)
+        with self._lock():
+            position, = _head.unpack_from(mm, _head_offset)
+            if position % size + length > size:
+                # entries never wrap around the end of the data area
+                position += size - position % size
+            head = position + length
+            _head.pack_into(mm, _head_offset, head)
+            start = self._data_offset + position % size
+            mm[start:start + len(content_type)] = content_type
+            mm[start + len(content_type):start + length] = body
+            slot_offset = self._choose_slot(offset, digest, head, size)
+            seq = _slot.unpack_from(mm, slot_offset)[0]
+            _slot.pack_into(mm, slot_offset, seq + 1, b'', 0, 0, 0)
+            _slot.pack_into(mm, slot_offset, seq + 2, digest, position,
+                            length, len(content_type))
+
+    def _choose_slot(self, offset, digest, head, size):
+        """
+        Returns the offset of the slot to use for a new entry: the slot
+        already holding the same key, an unused or outdated slot, or the
+        slot referencing the oldest data.
+        """
+        oldest = None
+        for i in range(_ways):
+            slot_offset = offset + i * _slot.size
+            seq, slot_digest, position, length, _ = \
+                _slot.unpack_from(self._mmap, slot_offset)
+            if slot_digest == digest or not seq or \
+                    head > position + size:
+                return slot_offset
+            if oldest is None or position < oldest[0]:
+                oldest = (position, slot_offset)
+        return oldest[1]
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        with self._lock():
+            head, = _head.unpack_from(self._mmap, _head_offset)
+            # advancing the head by the size of the data area invalidates
+            # all entries, even those currently being read.
+            _head.pack_into(self._mmap, _head_offset, head + self._size + 1)
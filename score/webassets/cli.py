@@ -26,11 +26,19 @@
 # the Licensee has his registered seat, an establishment or assets.
 
 import click
-import xxhash
 from urllib.parse import urlparse, parse_qsl
 from ._init import Request
+from .planner import BundlePlanner
+from .hashing import new_hash, feed
+from concurrent.futures import ThreadPoolExecutor
+import collections
 import email
 import io
+import json
+import multiprocessing
+import os
+import sys
+import time
 
 
 @click.group()
@@ -60,8 +68,9 @@ def asset_hash(clickctx, module, paths):
         else:
             proxy = webassets._get_proxy(module)
             path_iter = proxy.iter_default_paths()
-        for path in path_iter:
-            hash = webassets.get_asset_hash(module, path)
+        path_iter = list(path_iter)
+        hashes = webassets.get_asset_hashes(module, path_iter)
+        for path, hash in zip(path_iter, hashes):
             print('%s/%s %s' % (module, path, hash))
 
 
@@ -84,8 +93,8 @@ def asset_url(clickctx, module, paths):
         else:
             proxy = webassets._get_proxy(module)
             path_iter = proxy.iter_default_paths()
-        for path in path_iter:
-            print(webassets.get_asset_url(module, path))
+        for url in webassets.get_asset_urls(module, path_iter):
+            print(url)
 
 
 @main.command('request-response')
@@ -111,8 +120,8 @@ def request_response(clickctx, url, headers):
     for key, value in headers.items():
         print('%s: %s' % (key, value))
     print('')
-    if body:
-        print(body)
+    sys.stdout.flush()
+    sys.stdout.buffer.write(body)
 
 
 @main.command('bundle-url')
@@ -160,11 +169,328 @@ def freeze(clickctx):
     webassets = clickctx.obj['conf'].load('webassets')
     webassets.freeze = False
     modules = webassets.modules
-    hash = xxhash.xxh64()
+    hash = new_hash(webassets.hash_algorithm)
     for module in modules:
-        hash.update(webassets.get_bundle_hash(module))
+        feed(hash, webassets.get_bundle_hash(module))
     print(hash.hexdigest())
 
 
+@main.command()
+@click.option('-i', '--interval', default=1.0, show_default=True,
+              help='Seconds between two checks')
+@click.option('-m', '--manifest', 'manifest_file', type=click.Path(),
+              help='The manifest file to write, defaults to the configured '
+                   'manifest')
+@click.pass_context
+def watch(clickctx, interval, manifest_file):
+    """
+    Keeps the manifest up to date.
+
+    Checks the hashes of all default assets and bundles periodically. Changed
+    assets and bundles are written to the rootdir and the manifest is updated,
+    so running applications need not render any assets on their own.
+    """
+    webassets = clickctx.obj['conf'].load('webassets')
+    webassets.freeze = False
+    if not manifest_file:
+        manifest_file = webassets.manifest
+    if not manifest_file:
+        raise click.UsageError('No manifest file configured')
+    previous = {'assets': {}, 'bundles': {}}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as fp:
+            previous = json.load(fp)
+    while True:
+        try:
+            manifest = webassets.build_manifest()
+        except Exception as e:
+            # most likely a syntax error in a file currently being edited,
+            # try again in the next cycle.
+            click.echo('error: %s' % (e,), err=True)
+            time.sleep(interval)
+            continue
+        if manifest != previous:
+            for section in ('assets', 'bundles'):
+                for key, value in sorted(manifest[section].items()):
+                    if previous[section].get(key) != value:
+                        print('changed: %s' % (key,))
+            webassets.write_manifest(manifest, manifest_file)
+            previous = manifest
+        time.sleep(interval)
+
+
+@main.command()
+@click.option('-p', '--prefix', default='', help='Prefix for all URLs')
+@click.argument('old', type=click.Path(exists=True))
+@click.argument('new', type=click.Path(exists=True))
+@click.pass_context
+def diff(clickctx, old, new, prefix):
+    """
+    Lists URLs changed between two releases.
+
+    OLD and NEW may either be manifest files, as written by the "watch"
+    command, or rootdir folders. Every line of the output consists of a
+    symbol and a URL: "+" for added, "~" for changed and "-" for removed
+    assets and bundles.
+    """
+    webassets = clickctx.obj['conf'].load('webassets')
+    symbols = {'added': '+', 'changed': '~', 'removed': '-'}
+    changes = webassets.diff_manifests(
+        _load_manifest(webassets, old), _load_manifest(webassets, new))
+    for change, url in changes:
+        print('%s %s%s' % (symbols[change], prefix, url))
+
+
+def _load_manifest(webassets, path):
+    if os.path.isdir(path):
+        return webassets.manifest_from_rootdir(path)
+    with open(path) as fp:
+        return json.load(fp)
+
+
+@main.command('bench-replay')
+@click.option('-p', '--processes', default=1, show_default=True)
+@click.option('-t', '--threads', default=1, show_default=True)
+@click.option('-r', '--repeat', default=1, show_default=True,
+              help='How often to replay the whole log')
+@click.option('--prefix', default='/_assets', show_default=True,
+              help='URL prefix to strip from the logged paths')
+@click.argument('logfile', type=click.File())
+@click.pass_context
+def bench_replay(clickctx, logfile, processes, threads, repeat, prefix):
+    """
+    Replays logged requests for benchmarking.
+
+    Each line of LOGFILE describes a request: either as a JSON object with the
+    keys "url" and (optionally) "headers", or as the URL followed by
+    tab-separated headers, like "If-None-Match: abc" or "Accept-Encoding:
+    gzip". All requests are passed to get_request_response() from the given
+    number of processes and threads.
+    """
+    global _bench_webassets
+    _bench_webassets = clickctx.obj['conf'].load('webassets')
+    requests = []
+    for line in logfile:
+        line = line.strip()
+        if line:
+            requests.append(_parse_replay_line(line, prefix))
+    requests *= repeat
+    slices = [(requests[i::processes], threads) for i in range(processes)]
+    start = time.perf_counter()
+    if processes > 1:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes) as pool:
+            results = pool.map(_bench_process, slices)
+    else:
+        results = [_bench_process(slices[0])]
+    duration = time.perf_counter() - start
+    latencies = []
+    statuses = collections.Counter()
+    size = 0
+    for result_latencies, result_statuses, result_size in results:
+        latencies.extend(result_latencies)
+        statuses.update(result_statuses)
+        size += result_size
+    latencies.sort()
+    if not latencies:
+        return
+    print('requests:   %d' % len(latencies))
+    print('duration:   %.3fs' % duration)
+    print('throughput: %.1f req/s' % (len(latencies) / duration))
+    print('p50:        %.3fms' % (_percentile(latencies, 50) * 1000))
+    print('p99:        %.3fms' % (_percentile(latencies, 99) * 1000))
+    print('bytes:      %d' % size)
+    for status, count in sorted(statuses.items()):
+        print('status %d: %d' % (status, count))
+
+
+_bench_webassets = None
+
+
+def _parse_replay_line(line, prefix):
+    if line.startswith('{'):
+        data = json.loads(line)
+        url = data['url']
+        headers = data.get('headers', {})
+    else:
+        url, *header_lines = line.split('\t')
+        headers = {}
+        for header_line in header_lines:
+            key, value = header_line.split(':', maxsplit=1)
+            headers[key.strip()] = value.strip()
+    parsed = urlparse(url)
+    path = parsed.path
+    if prefix and path.startswith(prefix + '/'):
+        path = path[len(prefix):]
+    return Request(path, dict(parse_qsl(parsed.query)), headers)
+
+
+def _bench_process(args):
+    requests, threads = args
+    slices = [requests[i::threads] for i in range(threads)]
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(_bench_thread, slices))
+    latencies = []
+    statuses = collections.Counter()
+    size = 0
+    for result_latencies, result_statuses, result_size in results:
+        latencies.extend(result_latencies)
+        statuses.update(result_statuses)
+        size += result_size
+    return latencies, statuses, size
+
+
+def _bench_thread(requests):
+    get_request_response = _bench_webassets.get_request_response
+    latencies = []
+    statuses = collections.Counter()
+    size = 0
+    for request in requests:
+        start = time.perf_counter()
+        status, headers, body = get_request_response(request)
+        latencies.append(time.perf_counter() - start)
+        statuses[status] += 1
+        size += len(body)
+    return latencies, statuses, size
+
+
+def _percentile(sorted_values, percent):
+    index = round(percent / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+@main.command('transform-stats')
+@click.argument('module', required=False)
+@click.pass_context
+def transform_stats(clickctx, module):
+    """
+    Measures the configured bundle transforms.
+    """
+    webassets = clickctx.obj['conf'].load('webassets')
+    if module:
+        modules = (module,)
+    else:
+        modules = [module for module in webassets.modules
+                   if module in webassets.transforms]
+    for module in modules:
+        proxy = webassets._get_proxy(module)
+        paths = list(proxy.iter_default_bundle_paths())
+        webassets._create_bundle(proxy, module, paths)
+    for (module, identity), stats in webassets.transform_stats.items():
+        saved = stats['bytes_before'] - stats['bytes_after']
+        print('%s %s %.3fms -%d bytes (%.1f%%)' % (
+            module, identity, stats['seconds'] * 1000, saved,
+            100 * saved / (stats['bytes_before'] or 1)))
+
+
+@main.command('bundle-plan')
+@click.option('-o', '--output', type=click.Path(),
+              help='The plan file to write, defaults to the configured '
+                   'tpl.bundle_plan')
+@click.option('-n', '--min-count', type=int,
+              help='Minimum number of pages sharing an asset, defaults to '
+                   'the configured tpl.shared_bundles or 2')
+@click.argument('templates', nargs=-1)
+@click.pass_context
+def bundle_plan(clickctx, templates, output, min_count):
+    """
+    Writes a plan for shared bundles.
+
+    Renders the given html TEMPLATES (or all html templates known to
+    score.tpl) and records the assets passed to each webassets_link() call.
+    The resulting file can be configured as tpl.bundle_plan. Templates, that
+    cannot be rendered without variables, are reported and skipped.
+    """
+    webassets = clickctx.obj['conf'].load('webassets')
+    if not output and webassets.bundle_planner:
+        output = webassets.bundle_planner.file
+    if not output:
+        raise click.UsageError('No plan file configured')
+    if not min_count:
+        if webassets.bundle_planner:
+            min_count = webassets.bundle_planner.min_count
+        else:
+            min_count = 2
+    planner = BundlePlanner(min_count)
+
+    class Recorder:
+
+        def span_started(self, span):
+            pass
+
+        def span_finished(self, span):
+            if span.operation == 'link' and len(span.paths) > 1:
+                planner.add(span.module, span.paths)
+
+    tpl = webassets.tpl
+    if not templates:
+        templates = list(tpl.iter_paths(mimetype='text/html'))
+    recorder = Recorder()
+    webassets.add_trace_hook(recorder)
+    try:
+        for template in templates:
+            try:
+                tpl.render(template)
+            except Exception as e:
+                click.echo('skipped %s: %s' % (template, e), err=True)
+    finally:
+        webassets.remove_trace_hook(recorder)
+    planner.save(output)
+
+
+@main.command()
+@click.option('-p', '--prefix', default='/_assets',
+              help='URL prefix the assets are served under')
+@click.argument('folder', type=click.Path(file_okay=False))
+@click.pass_context
+def export(clickctx, folder, prefix):
+    """
+    Writes assets for a static web server.
+
+    Stores all default assets and bundles in FOLDER and generates two nginx
+    configuration snippets next to them: nginx-map.conf must be included in
+    the http block, nginx-location.conf in the server block. Requests for
+    hashed URLs are then answered from disk, everything else is passed to the
+    named location @score_webassets, which must be defined separately.
+    """
+    webassets = clickctx.obj['conf'].load('webassets')
+    folder = os.path.abspath(folder)
+    os.makedirs(folder, exist_ok=True)
+    exported = webassets.export(folder)
+    prefix = prefix.rstrip('/')
+    with open(os.path.join(folder, 'nginx-map.conf'), 'w') as fp:
+        fp.write('map "$uri:$arg__v" $score_webassets_file {\n')
+        fp.write('    default "";\n')
+        for url, file in exported:
+            urlpath, _, query = url.partition('?')
+            fp.write('    "%s%s:%s" "/%s";\n' % (
+                prefix, urlpath, query[len('_v='):], file))
+        fp.write('}\n')
+    with open(os.path.join(folder, 'nginx-location.conf'), 'w') as fp:
+        fp.write(_nginx_location % {
+            'prefix': prefix,
+            'folder': folder,
+        })
+    for url, file in exported:
+        print('%s -> %s' % (url, file))
+
+
+_nginx_location = """\
+location %(prefix)s/ {
+    if ($score_webassets_file) {
+        rewrite ^ /_score_webassets_static$score_webassets_file last;
+    }
+    try_files /_score_webassets_unhashed @score_webassets;
+}
+
+location /_score_webassets_static/ {
+    internal;
+    alias %(folder)s/;
+    gzip_static on;
+    add_header Cache-Control "public, max-age=31536000, immutable";
+}
+"""
+
+
 if __name__ == '__main__':
     main()
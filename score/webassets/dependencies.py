@@ -0,0 +1,91 @@
+# Copyright © 2015-2018 STRG.AT GmbH, Vienna, Austria
+# Copyright © 2018-2020 Necdet Can Ateşman, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in
+# the file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district
+# the Licensee has his registered seat, an establishment or assets.
+
+import threading
+
+
+class DependencyGraph:
+    """
+    Keeps track of the sources each :term:`asset` depends on, as reported by
+    :meth:`WebassetsProxy.dependencies
+    <score.webassets.WebassetsProxy.dependencies>`. Assets and sources are
+    identified by their module and their path. Sources need not be assets
+    themselves, they might be partials or other files only the proxy knows
+    of.
+    """
+
+    def __init__(self):
+        self._dependencies = {}
+        self._dependents = {}
+        self._lock = threading.Lock()
+
+    def update(self, module, path, dependencies):
+        """
+        Replaces the list of direct *dependencies* of the asset with given
+        *module* and *path*.
+        """
+        node = (module, path)
+        dependencies = frozenset((module, dep) for dep in dependencies)
+        with self._lock:
+            previous = self._dependencies.get(node, frozenset())
+            if previous == dependencies:
+                return
+            for dependency in previous - dependencies:
+                self._dependents[dependency].discard(node)
+            for dependency in dependencies - previous:
+                self._dependents.setdefault(dependency, set()).add(node)
+            if dependencies:
+                self._dependencies[node] = dependencies
+            else:
+                self._dependencies.pop(node, None)
+
+    def dependencies(self, module, path):
+        """
+        Returns the set of all paths the asset with given *module* and *path*
+        depends on, directly or transitively.
+        """
+        return self._walk(self._dependencies, module, path)
+
+    def dependents(self, module, path):
+        """
+        Returns the set of all asset paths, that depend on the source with
+        given *module* and *path*, directly or transitively.
+        """
+        return self._walk(self._dependents, module, path)
+
+    def _walk(self, edges, module, path):
+        result = set()
+        with self._lock:
+            pending = [(module, path)]
+            while pending:
+                node = pending.pop()
+                for neighbour in edges.get(node, ()):
+                    if neighbour[1] not in result:
+                        result.add(neighbour[1])
+                        pending.append(neighbour)
+        result.discard(path)
+        return result
@@ -0,0 +1,82 @@
+# Copyright © 2015-2018 STRG.AT GmbH, Vienna, Austria
+# Copyright © 2018-2020 Necdet Can Ateşman, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in
+# the file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district
+# the Licensee has his registered seat, an establishment or assets.
+
+"""
+Hash algorithms available for calculating :term:`asset hashes <asset hash>`.
+The algorithm can be configured via the :confkey:`hash_algorithm`
+configuration key of :func:`score.webassets.init`.
+"""
+
+import hashlib
+
+import xxhash
+
+
+def _blake2b():
+    return hashlib.blake2b(digest_size=16)
+
+
+algorithms = {
+    'xxh64': xxhash.xxh64,
+    'xxh3_64': getattr(xxhash, 'xxh3_64', None),
+    'xxh3_128': getattr(xxhash, 'xxh3_128', None),
+    'blake2b': _blake2b,
+}
+"""
+Maps names of hash algorithms to callables creating hash objects. The
+``xxh3_*`` algorithms are only available with xxhash 2.0 or newer.
+"""
+
+chunk_size = 64 * 1024
+
+
+def new_hash(algorithm='xxh64'):
+    """
+    Creates a new hash object using given *algorithm*. The returned object
+    supports the usual ``update()``, ``copy()`` and ``hexdigest()`` methods.
+    """
+    factory = algorithms.get(algorithm)
+    if factory is None:
+        raise ValueError('Hash algorithm "%s" not available' % (algorithm,))
+    return factory()
+
+
+def feed(hash, content):
+    """
+    Updates given *hash* object with *content*, which may be a `str`, a
+    `bytes` object or any other object supporting the buffer protocol, like a
+    `memoryview`. Strings are encoded as UTF-8 in chunks, so large contents do
+    not need to be copied as a whole.
+    """
+    if isinstance(content, str):
+        for start in range(0, len(content), chunk_size):
+            hash.update(content[start:start + chunk_size].encode('UTF-8'))
+        return hash
+    content = memoryview(content).cast('B')
+    for start in range(0, len(content), chunk_size):
+        hash.update(content[start:start + chunk_size])
+    return hash
@@ -0,0 +1,175 @@
+# Copyright © 2015-2018 STRG.AT GmbH, Vienna, Austria
+# Copyright © 2018-2020 Necdet Can Ateşman, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in
+# the file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district
+# the Licensee has his registered seat, an establishment or assets.
+
+
+"""
+Resolution of ``webassets_link`` and ``webassets_content`` calls at the
+time a Jinja2 template is compiled.
+
+If the hashes of all assets are fixed for the lifetime of a deployment --
+i.e. if the ``freeze`` value is a hash string, or if a ``manifest`` is
+configured -- the output of a call like ``{{ webassets_link('css') }}`` never
+changes. The :class:`WebassetsExtension` replaces such calls with their
+output before the template is compiled, so rendering the template does not
+invoke score.webassets at all:
+
+.. code-block:: python
+
+    from score.webassets.jinja2ext import WebassetsExtension
+
+    environment.add_extension(WebassetsExtension)
+    environment.webassets = score.webassets
+
+Only calls consisting exclusively of string literal arguments are resolved,
+all other calls (like ``{{ webassets_link('js', page.script) }}``) are left to
+the template globals registered by score.webassets.
+
+.. note::
+
+    Resolved calls bypass everything, that happens at rendering time: they
+    are not registered with an :class:`AssetCollector
+    <score.webassets.AssetCollector>`, so they are missing from its
+    preload links and are not deferred in a ``collect(deferred=True)``
+    block. If the hashes are taken from a manifest, templates need to be
+    compiled anew, whenever the manifest changes.
+"""
+
+import jinja2.ext
+from jinja2.lexer import Token
+
+
+_functions = {'webassets_link', 'webassets_content'}
+
+
+def resolve_constant_calls(webassets, stream):
+    """
+    Replaces all calls to ``webassets_link`` and ``webassets_content`` with
+    constant arguments in the Jinja2 token *stream* of a template with their
+    output, as provided by given configured *webassets* module. Returns an
+    iterable of the resulting tokens. Since the stream is already tokenized,
+    calls inside ``{% raw %}`` blocks and comments are left alone.
+
+    A call is only resolved, if all :term:`asset hashes <asset hash>` it
+    depends on are fixed, i.e. if the ``freeze`` value is a hash string, or
+    if all of them were found in the manifest. The *stream* is returned
+    unaltered, if neither is configured.
+    """
+    if not isinstance(webassets.freeze, str) and \
+            webassets._get_manifest() is None:
+        return stream
+    return _resolve_tokens(webassets, list(stream))
+
+
+def _resolve_tokens(webassets, tokens):
+    index = 0
+    while index < len(tokens):
+        end, function, arguments = _match_call(tokens, index)
+        if function is not None:
+            output = _resolve(webassets, function, arguments)
+            if output is not None:
+                yield Token(tokens[index].lineno, 'data', output)
+                index = end
+                continue
+        yield tokens[index]
+        index += 1
+
+
+def _match_call(tokens, index):
+    """
+    Checks whether the tokens starting at *index* form an expression like
+    ``{{ webassets_link('css', 'a.css') }}``. Returns a 3-tuple ``(end,
+    function, arguments)``, where *end* is the index after the expression,
+    or ``(index, None, None)`` if there is no such expression.
+    """
+    nomatch = (index, None, None)
+    types = [token.type for token in tokens[index:index + 4]]
+    if types != ['variable_begin', 'name', 'lparen', 'string'] or \
+            tokens[index + 1].value not in _functions:
+        return nomatch
+    function = tokens[index + 1].value
+    arguments = [tokens[index + 3].value]
+    index += 4
+    while index < len(tokens) and tokens[index].type == 'comma':
+        index += 1
+        if index < len(tokens) and tokens[index].type == 'string':
+            arguments.append(tokens[index].value)
+            index += 1
+        else:
+            # trailing comma
+            break
+    types = [token.type for token in tokens[index:index + 2]]
+    if types != ['rparen', 'variable_end']:
+        return nomatch
+    return index + 2, function, arguments
+
+
+def _resolve(webassets, function, arguments):
+    # templates are often compiled while the first page using them is being
+    # rendered, i.e. possibly within a collect() block.
+    token = webassets._collector.set(None)
+    try:
+        # hashes taken from the manifest (or a freeze string) are not traced,
+        # any traced hash operation was thus calculated from the content.
+        with webassets.trace() as collector:
+            if function == 'webassets_link':
+                output = webassets.generate_html_tag(*arguments)
+            else:
+                output = webassets.generate_html_content(*arguments)
+                module, paths = arguments[0], arguments[1:]
+                if not paths:
+                    proxy = webassets._get_proxy(module)
+                    paths = list(proxy.iter_default_bundle_paths())
+                webassets.get_asset_hashes(module, paths)
+    except Exception:
+        # leave the call to the runtime, which will report the error
+        return None
+    finally:
+        webassets._collector.reset(token)
+    if any(span.operation == 'hash' for _, span in collector.spans):
+        # at least one hash is not fixed, the output might change
+        return None
+    return output
+
+
+class WebassetsExtension(jinja2.ext.Extension):
+    """
+    A Jinja2 extension resolving constant calls to the webassets template
+    globals while templates are compiled (see
+    :func:`resolve_constant_calls`). The configured score.webassets module
+    must be assigned to the environment's ``webassets`` attribute, the
+    extension does nothing until then.
+    """
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(webassets=None)
+
+    def filter_stream(self, stream):
+        webassets = self.environment.webassets
+        if webassets is None:
+            return stream
+        return resolve_constant_calls(webassets, stream)
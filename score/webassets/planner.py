@@ -0,0 +1,198 @@
+# Copyright © 2015-2018 STRG.AT GmbH, Vienna, Austria
+# Copyright © 2018-2020 Necdet Can Ateşman, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in
+# the file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district
+# the Licensee has his registered seat, an establishment or assets.
+
+import json
+import os
+import threading
+
+
+class BundlePlanner:
+    """
+    Decides how the :term:`assets <asset>` of ad-hoc bundles are distributed
+    among the bundles actually delivered to the browser.
+
+    The planner knows all path lists, that were requested for each module,
+    either because they were loaded from a *plan file* created at build time,
+    or because they were passed to :meth:`add` at runtime. Assets appearing in
+    at least *min_count* of these path lists are considered *common*. They
+    are grouped into fixed :meth:`common bundles <common_bundles>`, that can
+    be cached by the browser independently of the page-specific remainder.
+
+    If a plan file was loaded, the plan is fixed: path lists added at runtime
+    are still recorded (and will be written by :meth:`save`), but do not
+    alter the result of :meth:`split`. This keeps the bundle URLs stable
+    during the lifetime of a deployment.
+    """
+
+    def __init__(self, min_count=2, file=None):
+        self.min_count = min_count
+        self.file = file
+        self._path_lists = {}
+        self._common_paths = {}
+        self._common_bundles = {}
+        self._lock = threading.Lock()
+        self.fixed = False
+        if file and os.path.exists(file):
+            self.load(file)
+
+    def load(self, file):
+        """
+        Loads path lists from given JSON *file*, as written by :meth:`save`,
+        and fixes the plan.
+        """
+        with open(file) as fp:
+            data = json.load(fp)
+        with self._lock:
+            for module, path_lists in data.items():
+                known = self._path_lists.setdefault(module, {})
+                for paths in path_lists:
+                    known[tuple(paths)] = True
+            self._common_paths = {}
+            self._common_bundles = {}
+            self.fixed = True
+
+    def save(self, file=None):
+        """
+        Writes all known path lists to given JSON *file*, which defaults to
+        the file given to the constructor.
+        """
+        if file is None:
+            file = self.file
+        with self._lock:
+            data = dict((module, [list(paths) for paths in path_lists])
+                        for module, path_lists in self._path_lists.items())
+        tmpfile = '%s.%d.tmp' % (file, os.getpid())
+        with open(tmpfile, 'w') as fp:
+            json.dump(data, fp, indent=2, sort_keys=True)
+        os.replace(tmpfile, file)
+
+    def add(self, module, paths):
+        """
+        Records that a bundle consisting of given *paths* in given *module*
+        was requested.
+        """
+        key = tuple(paths)
+        known = self._path_lists.get(module)
+        if known is not None and key in known:
+            return
+        with self._lock:
+            known = self._path_lists.setdefault(module, {})
+            if key in known:
+                return
+            known[key] = not self.fixed
+            if not self.fixed:
+                self._common_paths.pop(module, None)
+                self._common_bundles.pop(module, None)
+
+    def common_paths(self, module):
+        """
+        Returns the set of paths in given *module*, that are shared by at
+        least :attr:`min_count` known path lists.
+        """
+        try:
+            return self._common_paths[module]
+        except KeyError:
+            pass
+        with self._lock:
+            counts = {}
+            for paths, planned in self._path_lists.get(module, {}).items():
+                if not planned:
+                    continue
+                for path in paths:
+                    counts[path] = counts.get(path, 0) + 1
+            common = frozenset(path for path, count in counts.items()
+                               if count >= self.min_count)
+            self._common_paths[module] = common
+        return common
+
+    def common_bundles(self, module):
+        """
+        Returns the list of common bundles of given *module*, each one being
+        a tuple of paths. The :meth:`common paths <common_paths>` are grouped
+        by the path lists they appear in: paths shared by exactly the same
+        path lists end up in the same bundle. Each bundle retains the order
+        of its paths in these path lists. Groups consisting of a single path
+        are omitted, since they are not worth an additional request.
+        """
+        try:
+            return self._common_bundles[module]
+        except KeyError:
+            pass
+        common_paths = self.common_paths(module)
+        with self._lock:
+            path_lists = sorted(
+                paths
+                for paths, planned in self._path_lists.get(module, {}).items()
+                if planned)
+            members = {}
+            for index, paths in enumerate(path_lists):
+                for path in paths:
+                    if path in common_paths:
+                        members.setdefault(path, set()).add(index)
+            groups = {}
+            for paths in path_lists:
+                for path in paths:
+                    if path not in common_paths:
+                        continue
+                    group = groups.setdefault(
+                        frozenset(members[path]), [])
+                    if path not in group:
+                        group.append(path)
+            bundles = [tuple(group) for group in groups.values()
+                       if len(group) > 1]
+            self._common_bundles[module] = bundles
+        return bundles
+
+    def split(self, module, paths):
+        """
+        Splits given *paths* into a list of path lists. Each :meth:`common
+        bundle <common_bundles>`, that appears in *paths* as a contiguous
+        run in the same order, is delivered as a bundle of its own. The
+        remaining paths are delivered in between, so concatenating the
+        returned lists always yields the original *paths*.
+        """
+        self.add(module, paths)
+        paths = list(paths)
+        bundles = dict((bundle[0], bundle)
+                       for bundle in self.common_bundles(module))
+        parts = []
+        specific = []
+        index = 0
+        while index < len(paths):
+            bundle = bundles.get(paths[index])
+            if bundle and tuple(paths[index:index + len(bundle)]) == bundle:
+                if specific:
+                    parts.append(specific)
+                    specific = []
+                parts.append(list(bundle))
+                index += len(bundle)
+            else:
+                specific.append(paths[index])
+                index += 1
+        if specific:
+            parts.append(specific)
+        return parts
@@ -25,17 +25,32 @@
 # the discretion of STRG.AT GmbH also the competent court, in whose district
 # the Licensee has his registered seat, an establishment or assets.
 
+from collections import OrderedDict
 import abc
-from score.tpl import TemplateNotFound
-import xxhash
+import mimetypes
+import mmap
+import os
 import re
+import threading
+import time
+
+from .hashing import new_hash, feed
 
 
 class WebassetsProxy(abc.ABC):
     """
     A proxy object defining the behaviour of a type of web asset.
+
+    .. attribute:: hash_algorithm
+
+        Name of the :mod:`hash algorithm <score.webassets.hashing>` to use for
+        calculating hashes. Will be overwritten with the configured value of
+        :confkey:`hash_algorithm`, when the proxy is retrieved by the
+        configured webassets module.
     """
 
+    hash_algorithm = 'xxh64'
+
     @abc.abstractmethod
     def iter_default_paths(self):
         """
@@ -63,6 +78,30 @@ class WebassetsProxy(abc.ABC):
         content of the asset changes.
         """
 
+    def dependencies(self, path):
+        """
+        Returns an iterable of all sources the asset with given *path*
+        includes directly, like css files loaded via ``@import`` or partial
+        templates. The values are paths in the same namespace as the asset
+        paths, but need not be valid assets themselves.
+
+        This information is used to invalidate the hashes of all assets
+        depending on a changed source (see
+        :meth:`ConfiguredWebassetsModule.invalidate
+        <score.webassets.ConfiguredWebassetsModule.invalidate>`). The default
+        implementation returns an empty tuple.
+        """
+        return ()
+
+    def hashes(self, paths):
+        """
+        Returns an iterable of the hashes of all given *paths*, in the same
+        order. The default implementation just calls :meth:`hash` for each
+        path, but proxies might be able to provide a more efficient
+        implementation.
+        """
+        return [self.hash(path) for path in paths]
+
     @abc.abstractmethod
     def render(self, path):
         """
@@ -83,6 +122,54 @@ class WebassetsProxy(abc.ABC):
         javascript assets.
         """
 
+    def render_typed_url(self, url, mimetype, **kwargs):
+        """
+        Like :meth:`render_url`, but also receives the *mimetype* of the
+        asset (or bundle) behind the *url*. This is the method actually
+        called when generating HTML tags. The default implementation just
+        calls :meth:`render_url`, proxies serving assets of different mime
+        types can override it.
+        """
+        return self.render_url(url, **kwargs)
+
+    def render_inline(self, content, mimetype):
+        """
+        Returns the string to embed in an HTML document to include given
+        *content* directly, or `None` if it cannot be inlined. The *content*
+        is a `str` for textual mime types and a bytes-like object otherwise.
+
+        This method is only called for assets smaller than the configured
+        :confkey:`tpl.inline_threshold`. The default implementation embeds
+        stylesheets in a <style> tag and javascript in a <script> tag, unless
+        the content contains the closing tag.
+        """
+        if mimetype == 'text/css':
+            tag = 'style'
+        elif mimetype in ('application/javascript', 'text/javascript'):
+            tag = 'script'
+        else:
+            return None
+        if '</' + tag in content.lower():
+            return None
+        return '<%s>%s</%s>' % (tag, content, tag)
+
+    def preload_type(self, mimetype):
+        """
+        Returns the value of the ``as`` attribute of a preload link for an
+        asset (or bundle) with given *mimetype*, or `None` if such assets
+        should not be preloaded. The default implementation knows about
+        stylesheets, scripts, fonts and images.
+        """
+        if mimetype == 'text/css':
+            return 'style'
+        if mimetype in ('application/javascript', 'text/javascript'):
+            return 'script'
+        if mimetype.startswith('font/'):
+            return 'font'
+        if mimetype.startswith('image/'):
+            return 'image'
+        return None
+
     @abc.abstractmethod
     def create_bundle(self, paths):
         """
@@ -90,15 +177,22 @@ class WebassetsProxy(abc.ABC):
         by their given *paths*.
         """
 
+    def new_hash(self):
+        """
+        Creates a new hash object using this proxy's :attr:`hash_algorithm`.
+        Data can be added with :func:`score.webassets.hashing.feed`.
+        """
+        return new_hash(self.hash_algorithm)
+
     def bundle_hash(self, paths):
         """
         Provides the hash of the bundle with given *paths*.
         """
-        hash = xxhash.xxh64()
+        hash = self.new_hash()
         for path in sorted(paths):
             part = self.hash(path)
             if part:
-                hash.update(part.encode('UTF-8'))
+                feed(hash, part)
             hash.update(b'\0')
         return hash.hexdigest()
 
@@ -140,12 +234,21 @@ class TemplateWebassetsProxy(WebassetsProxy):
     def __init__(self, tpl, mimetype):
         self.tpl = tpl
         self._mimetype = mimetype
-        self.postprocessors_hash = xxhash.xxh64()
-        postprocessors = tpl.filetypes[self._mimetype].postprocessors
-        # TODO: the next line just includes the number of postprocessors, it
-        # should somehow base the hash on the postprocessor instances, not just
-        # the sheer amount
-        self.postprocessors_hash.update(bytes([len(postprocessors)]))
+        self._postprocessors_hash = None
+
+    @property
+    def postprocessors_hash(self):
+        # computed on first access: the tpl module might not have registered
+        # all of its file types at the time this proxy is constructed.
+        if self._postprocessors_hash is None:
+            hash = self.new_hash()
+            postprocessors = self.tpl.filetypes[self._mimetype].postprocessors
+            # TODO: the next line just includes the number of postprocessors,
+            # it should somehow base the hash on the postprocessor instances,
+            # not just the sheer amount
+            hash.update(bytes([len(postprocessors)]))
+            self._postprocessors_hash = hash
+        return self._postprocessors_hash
 
     def iter_default_paths(self):
         hidden_regex = re.compile(r'(^|/)_')
@@ -155,6 +258,7 @@ class TemplateWebassetsProxy(WebassetsProxy):
             if not hidden_regex.search(path))
 
     def validate_path(self, path):
+        from score.tpl import TemplateNotFound
         try:
             return self.tpl.mimetype(path) == self._mimetype
         except TemplateNotFound:
@@ -166,16 +270,26 @@ class TemplateWebassetsProxy(WebassetsProxy):
         """
         hash = self.postprocessors_hash.copy()
         for path in sorted(paths):
-            hash.update(self.tpl.hash(path))
+            feed(hash, self.tpl.hash(path))
             hash.update(b'\0')
         return hash.hexdigest()
 
     def hash(self, path):
         hash = self.postprocessors_hash.copy()
-        hash.update(self.tpl.hash(path))
+        feed(hash, self.tpl.hash(path))
         return hash.hexdigest()
 
+    def hashes(self, paths):
+        base = self.postprocessors_hash
+        result = []
+        for path in paths:
+            hash = base.copy()
+            feed(hash, self.tpl.hash(path))
+            result.append(hash.hexdigest())
+        return result
+
     def render(self, path):
+        from score.tpl import TemplateNotFound
         try:
             return self.tpl.render(path)
         except TemplateNotFound:
@@ -199,3 +313,316 @@ class TemplateWebassetsProxy(WebassetsProxy):
     @abc.abstractmethod
     def create_bundle(self, paths):
         pass
+
+
+class FileWebassetsProxy(WebassetsProxy):
+    """
+    A :class:`WebassetsProxy` serving all files inside a *folder* as they are,
+    which makes it suitable for binary assets like fonts and images.
+
+    Just like :class:`TemplateWebassetsProxy`, the default path list omits
+    all files and folders starting with an underscore (and those starting
+    with a dot). Unlike there, such files are not served at all, since the
+    folder might contain files not meant to be public, like version control
+    data. The mime type of each file is guessed from its extension.
+
+    The hash of a file is calculated from its content, but is only
+    re-calculated, if the file's size, modification time or inode changes.
+    Contents are memory-mapped instead of being read into memory.
+
+    Files of different mime types cannot be :term:`bundled <asset bundle>`,
+    and binary files cannot be bundled at all, which is why the
+    :meth:`default bundle paths <WebassetsProxy.iter_default_bundle_paths>`
+    are empty.
+    """
+
+    _hidden_regex = re.compile(r'(^|[/\\])[_.]')
+
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self._digests = {}
+
+    def _file(self, path):
+        if self._hidden_regex.search(path):
+            return None
+        file = os.path.normpath(os.path.join(self.folder, path))
+        if not file.startswith(self.folder + os.sep):
+            return None
+        return file
+
+    def iter_default_paths(self):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(self.folder):
+            relpath = os.path.relpath(dirpath, self.folder)
+            relpath = relpath.replace(os.sep, '/')
+            for filename in filenames:
+                if relpath == '.':
+                    path = filename
+                else:
+                    path = '%s/%s' % (relpath, filename)
+                if not self._hidden_regex.search(path):
+                    paths.append(path)
+        yield from sorted(paths)
+
+    def iter_default_bundle_paths(self):
+        return iter(())
+
+    def validate_path(self, path):
+        file = self._file(path)
+        return file is not None and os.path.isfile(file)
+
+    def hash(self, path):
+        file = self._file(path)
+        if file is None:
+            from ._init import AssetNotFound
+            raise AssetNotFound('???', path)
+        stat = os.stat(file)
+        key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        try:
+            cached_key, digest = self._digests[path]
+            if cached_key == key:
+                return digest
+        except KeyError:
+            pass
+        digest = feed(self.new_hash(), self._map(path)).hexdigest()
+        self._digests[path] = (key, digest)
+        return digest
+
+    def _map(self, path):
+        file = self._file(path)
+        if file is None:
+            from ._init import AssetNotFound
+            raise AssetNotFound('???', path)
+        with open(file, 'rb') as fp:
+            try:
+                return memoryview(mmap.mmap(
+                    fp.fileno(), 0, access=mmap.ACCESS_READ))
+            except ValueError:
+                # empty files cannot be mapped
+                return memoryview(b'')
+
+    def render(self, path):
+        """
+        Returns the content of the file as a `str` for textual mime types
+        (assuming UTF-8 encoding), or as a memory-mapped `memoryview`
+        otherwise.
+        """
+        from ._init import _is_text
+        content = self._map(path)
+        if _is_text(self.mimetype(path)):
+            return str(content, 'UTF-8')
+        return content
+
+    def mimetype(self, path):
+        mimetype = mimetypes.guess_type(path)[0]
+        return mimetype or 'application/octet-stream'
+
+    def render_url(self, url, **kwargs):
+        mimetype = mimetypes.guess_type(url.split('?', maxsplit=1)[0])[0]
+        return self.render_typed_url(url, mimetype, **kwargs)
+
+    def render_typed_url(self, url, mimetype, **kwargs):
+        if mimetype == 'text/css':
+            return '<link rel="stylesheet" href="%s">' % (url,)
+        if mimetype in ('application/javascript', 'text/javascript'):
+            return '<script src="%s"></script>' % (url,)
+        if mimetype and mimetype.startswith('image/'):
+            return '<img src="%s">' % (url,)
+        if mimetype and mimetype.startswith('font/'):
+            return ('<link rel="preload" href="%s" as="font" crossorigin>'
+                    % (url,))
+        return '<link rel="prefetch" href="%s">' % (url,)
+
+    def create_bundle(self, paths):
+        mimetype = self.bundle_mimetype(paths)
+        from ._init import _is_text
+        if not _is_text(mimetype):
+            raise ValueError('Cannot bundle files of type %s' % (mimetype,))
+        return ''.join(map(self.render, paths))
+
+    def bundle_mimetype(self, paths):
+        mimetypes = set(map(self.mimetype, paths))
+        if len(mimetypes) != 1:
+            return 'application/octet-stream'
+        return mimetypes.pop()
+
+
+class CachingWebassetsProxy(WebassetsProxy):
+    """
+    A :class:`WebassetsProxy` wrapping another *proxy*, memoizing the results
+    of its :meth:`validate_path <WebassetsProxy.validate_path>`, :meth:`hash
+    <WebassetsProxy.hash>`, :meth:`bundle_hash <WebassetsProxy.bundle_hash>`,
+    :meth:`render <WebassetsProxy.render>` and :meth:`create_bundle
+    <WebassetsProxy.create_bundle>` methods. All other calls and attribute
+    accesses are passed through to the wrapped proxy, so existing proxies can
+    be wrapped without any modification:
+
+    .. code-block:: python
+
+        def score_webassets_proxy(self):
+            return CachingWebassetsProxy(MyobjectsWebassets(self.tpl))
+
+    The cache holds at most *max_entries* values, and the rendered contents
+    it holds will not exceed *max_bytes*. The least recently used values are
+    discarded first. If *ttl* is given, values older than that many seconds
+    are discarded, too.
+
+    Rendered contents are cached per hash: a changed hash will thus also
+    cause the content to be rendered again. This means that the *ttl* (or
+    calls to :meth:`invalidate`) determine, how long a changed asset may go
+    unnoticed. Whenever a content is rendered, its hash is calculated anew,
+    so a content is never cached under the outdated hash of an earlier
+    version.
+    """
+
+    def __init__(self, proxy, *, max_entries=1024, max_bytes=64 * 1024 * 1024,
+                 ttl=None):
+        self.proxy = proxy
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def hash_algorithm(self):
+        return self.proxy.hash_algorithm
+
+    @hash_algorithm.setter
+    def hash_algorithm(self, value):
+        self.proxy.hash_algorithm = value
+        self.invalidate()
+
+    def __getattr__(self, name):
+        return getattr(self.proxy, name)
+
+    def _cached(self, key, calculate):
+        found, value = self._lookup(key)
+        if found:
+            return value
+        return self._store(key, calculate())
+
+    def _lookup(self, key):
+        """
+        Returns a 2-tuple ``(found, value)`` describing the cache entry for
+        given *key*.
+        """
+        now = time.monotonic()
+        with self._lock:
+            try:
+                value, size, expires = self._cache[key]
+            except KeyError:
+                return False, None
+            if expires is None or expires > now:
+                self._cache.move_to_end(key)
+                return True, value
+            del self._cache[key]
+            self._bytes -= size
+        return False, None
+
+    def _store(self, key, value):
+        """
+        Stores given *value* under *key* and returns it.
+        """
+        now = time.monotonic()
+        if isinstance(value, (str, bytes, bytearray, memoryview)):
+            size = len(value)
+        else:
+            size = 0
+        if size > self.max_bytes:
+            return value
+        expires = None if self.ttl is None else now + self.ttl
+        with self._lock:
+            previous = self._cache.pop(key, None)
+            if previous:
+                self._bytes -= previous[1]
+            self._cache[key] = (value, size, expires)
+            self._bytes += size
+            while (len(self._cache) > self.max_entries or
+                    self._bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self._cache.popitem(last=False)
+                self._bytes -= evicted_size
+        return value
+
+    def invalidate(self, path=None):
+        """
+        Discards all cached values concerning given *path*, including those
+        of bundles containing it. Discards the whole cache, if *path* is
+        omitted.
+        """
+        with self._lock:
+            if path is None:
+                self._cache.clear()
+                self._bytes = 0
+                return
+            for key in list(self._cache):
+                if path == key[1] or (
+                        isinstance(key[1], tuple) and path in key[1]):
+                    self._bytes -= self._cache.pop(key)[1]
+
+    def iter_default_paths(self):
+        return self.proxy.iter_default_paths()
+
+    def iter_default_bundle_paths(self):
+        return self.proxy.iter_default_bundle_paths()
+
+    def validate_path(self, path):
+        return self._cached(
+            ('validate_path', path), lambda: self.proxy.validate_path(path))
+
+    def dependencies(self, path):
+        return self.proxy.dependencies(path)
+
+    def hash(self, path):
+        return self._cached(('hash', path), lambda: self.proxy.hash(path))
+
+    def hashes(self, paths):
+        return [self.hash(path) for path in paths]
+
+    def render(self, path):
+        found, content = self._lookup(('render', path, self.hash(path)))
+        if found:
+            return content
+        # the cached hash might be outdated. the content must be stored
+        # under the hash of the version that was actually rendered, or a
+        # new content would be written to the rootdir under an old hash.
+        hash_ = self._store(('hash', path), self.proxy.hash(path))
+        return self._store(('render', path, hash_), self.proxy.render(path))
+
+    def mimetype(self, path):
+        return self.proxy.mimetype(path)
+
+    def render_inline(self, content, mimetype):
+        return self.proxy.render_inline(content, mimetype)
+
+    def preload_type(self, mimetype):
+        return self.proxy.preload_type(mimetype)
+
+    def render_url(self, url, **kwargs):
+        return self.proxy.render_url(url, **kwargs)
+
+    def render_typed_url(self, url, mimetype, **kwargs):
+        return self.proxy.render_typed_url(url, mimetype, **kwargs)
+
+    def create_bundle(self, paths):
+        paths = tuple(paths)
+        key = ('create_bundle', paths, self.bundle_hash(paths))
+        found, content = self._lookup(key)
+        if found:
+            return content
+        # see render()
+        sorted_paths = sorted(paths)
+        hash_ = self._store(('bundle_hash', tuple(sorted_paths)),
+                            self.proxy.bundle_hash(sorted_paths))
+        return self._store(('create_bundle', paths, hash_),
+                           self.proxy.create_bundle(list(paths)))
+
+    def bundle_hash(self, paths):
+        paths = tuple(sorted(paths))
+        return self._cached(
+            ('bundle_hash', paths),
+            lambda: self.proxy.bundle_hash(list(paths)))
+
+    def bundle_mimetype(self, paths):
+        return self.proxy.bundle_mimetype(paths)
@@ -0,0 +1,152 @@
+# Copyright © 2015-2018 STRG.AT GmbH, Vienna, Austria
+# Copyright © 2018-2020 Necdet Can Ateşman, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in
+# the file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district
+# the Licensee has his registered seat, an establishment or assets.
+
+"""
+Tracing of webassets operations. Hooks can be registered via
+:meth:`ConfiguredWebassetsModule.add_trace_hook
+<score.webassets.ConfiguredWebassetsModule.add_trace_hook>`, or limited to a
+single page rendering with :meth:`ConfiguredWebassetsModule.trace
+<score.webassets.ConfiguredWebassetsModule.trace>`.
+
+A hook is an object providing the two methods ``span_started(span)`` and
+``span_finished(span)``, which will receive :class:`Span` objects. No spans
+are created at all, if there are no hooks.
+"""
+
+import time
+
+
+class Span:
+    """
+    A single traced operation. The *operation* is one of the following
+    strings:
+
+    - ``link``: a call to :meth:`generate_html_tag
+      <score.webassets.ConfiguredWebassetsModule.generate_html_tag>`
+    - ``content``: a call to :meth:`generate_html_content
+      <score.webassets.ConfiguredWebassetsModule.generate_html_content>`
+    - ``validate_path``, ``hash``, ``render``, ``create_bundle``: calls to
+      the respective :class:`proxy <score.webassets.WebassetsProxy>` methods
+    - ``write``: writing an asset or bundle to the *rootdir*
+
+    .. attribute:: module
+
+        The name of the :term:`asset module`.
+
+    .. attribute:: paths
+
+        A tuple of the involved :term:`asset paths <asset path>`.
+
+    .. attribute:: cache
+
+        Either ``hit`` or ``miss`` for operations, that can be skipped if the
+        result was cached (like ``hash`` and ``write``), `None` otherwise.
+
+    .. attribute:: start
+
+        Value of :func:`time.perf_counter` at the start of the operation.
+
+    .. attribute:: duration
+
+        Duration of the operation in seconds, or `None` if the operation is
+        still in progress.
+    """
+
+    __slots__ = ('operation', 'module', 'paths', 'cache', 'start',
+                 'duration', '_hooks')
+
+    def __init__(self, hooks, operation, module, paths, cache=None):
+        self._hooks = hooks
+        self.operation = operation
+        self.module = module
+        self.paths = tuple(paths)
+        self.cache = cache
+        self.start = None
+        self.duration = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        for hook in self._hooks:
+            hook.span_started(self)
+        return self
+
+    def __exit__(self, *args):
+        self.duration = time.perf_counter() - self.start
+        for hook in self._hooks:
+            hook.span_finished(self)
+
+
+class TraceCollector:
+    """
+    A trace hook storing all finished spans in :attr:`spans`, together with
+    their nesting depth.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._depth = 0
+
+    def span_started(self, span):
+        self._depth += 1
+
+    def span_finished(self, span):
+        self._depth -= 1
+        self.spans.append((self._depth, span))
+
+    def summary(self):
+        """
+        Returns a `dict` mapping operation names to 3-tuples ``(count,
+        cache hits, total seconds)``.
+        """
+        summary = {}
+        for _, span in self.spans:
+            count, hits, duration = summary.get(span.operation, (0, 0, 0.0))
+            summary[span.operation] = (
+                count + 1,
+                hits + (span.cache == 'hit'),
+                duration + span.duration)
+        return summary
+
+    def dump(self):
+        """
+        Returns a human-readable breakdown of the collected spans: a summary
+        per operation followed by all spans in the order they were started.
+        """
+        lines = ['%-15s %6s %6s %10s' % ('operation', 'count', 'hits', 'ms')]
+        for operation, (count, hits, duration) in sorted(
+                self.summary().items()):
+            lines.append('%-15s %6d %6d %10.3f' % (
+                operation, count, hits, duration * 1000))
+        lines.append('')
+        for depth, span in sorted(self.spans, key=lambda s: s[1].start):
+            line = '%s%s %s %s %.3fms' % (
+                '  ' * depth, span.operation, span.module,
+                ','.join(span.paths), span.duration * 1000)
+            if span.cache:
+                line += ' (%s)' % (span.cache,)
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,82 @@
+# Copyright © 2015-2018 STRG.AT GmbH, Vienna, Austria
+# Copyright © 2018-2020 Necdet Can Ateşman, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in
+# the file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district
+# the Licensee has his registered seat, an establishment or assets.
+
+"""
+Bundle transforms, that can be configured via the :confkey:`transforms.*`
+configuration keys of :func:`score.webassets.init`.
+
+A bundle transform is a callable accepting the *content* of a bundle and its
+*mimetype*, which returns the transformed content. It is invoked once for each
+bundle :term:`hash <asset hash>`, when the bundle is written to the
+configured ``rootdir``, and whenever the content of a bundle is embedded into
+a page with ``webassets_content``. Transforms may provide an ``identity``
+string, which will become part of the bundle hash. It should change, whenever
+the output of the transform changes. The dotted path to the transform is used
+if this attribute is missing.
+"""
+
+import re
+
+
+_css_comment_regex = re.compile(
+    r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.DOTALL)
+
+_css_whitespace_regex = re.compile(
+    r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|\s*\n\s*')
+
+
+def _keep_strings(match):
+    return match.group(1) or ''
+
+
+def strip_css_comments(content, mimetype):
+    """
+    Removes all comments from css bundles. Other bundles are returned
+    unaltered.
+    """
+    if mimetype != 'text/css':
+        return content
+    return _css_comment_regex.sub(_keep_strings, content)
+
+
+strip_css_comments.identity = 'strip_css_comments:1'
+
+
+def strip_css_whitespace(content, mimetype):
+    """
+    Removes indentation, trailing whitespace and empty lines from css bundles.
+    Other bundles are returned unaltered.
+    """
+    if mimetype != 'text/css':
+        return content
+
+    def replace(match):
+        return match.group(1) or '\n'
+    return _css_whitespace_regex.sub(replace, content).strip()
+
+
+strip_css_whitespace.identity = 'strip_css_whitespace:1'